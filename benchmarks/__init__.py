@@ -0,0 +1,4 @@
+"""
+Benchmarks for jinja2static, run against synthetic projects of a configurable
+shape. Run 'python -m benchmarks --help' from the repository root.
+"""
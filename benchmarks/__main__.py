@@ -0,0 +1,273 @@
+"""
+Generates a synthetic project, runs every benchmark scenario against it and
+saves the results as JSON, optionally comparing them to an earlier run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, fields
+from pathlib import Path
+
+from .measure import SCENARIOS
+from .site import SiteShape, generate_site
+
+BENCHMARKS_PATH = Path(__file__).parent
+REPO_PATH = BENCHMARKS_PATH.parent
+
+# Metrics where higher is better; every other metric is a duration or size.
+HIGHER_IS_BETTER = {"requests_per_s", "mb_per_s"}
+
+# Informational metrics, never flagged as regressions.
+UNCOMPARED = {"pages_rebuilt"}
+
+
+def git_commit() -> str | None:
+    process = subprocess.run(
+        ["git", "-C", str(REPO_PATH), "rev-parse", "--short", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    return process.stdout.strip() or None
+
+
+def measure(scenario: str, project_path: Path, *options: str) -> dict:
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(REPO_PATH / "src"), str(REPO_PATH)]),
+    }
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.measure",
+            scenario,
+            str(project_path),
+            *options,
+        ],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=REPO_PATH,
+    )
+    if process.returncode:
+        raise RuntimeError(f"Scenario '{scenario}' failed:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def clean(project_path: Path):
+    """Removes the outputs and caches of earlier builds."""
+    shutil.rmtree(project_path / "dist", ignore_errors=True)
+    shutil.rmtree(project_path / ".jinja2static", ignore_errors=True)
+
+
+def run_scenarios(project_path: Path, shape: SiteShape, args) -> dict[str, list[dict]]:
+    jobs = ["--jobs", str(args.jobs)] if args.jobs else []
+    runs = {scenario: [] for scenario in args.scenarios}
+    for repeat in range(args.repeat):
+        print(f"Run {repeat + 1} of {args.repeat}...", file=sys.stderr)
+        clean(project_path)
+        if "cold_build" in runs:
+            runs["cold_build"].append(measure("cold_build", project_path, *jobs))
+        else:
+            # The other scenarios need a built site.
+            measure("cold_build", project_path, *jobs)
+        if "startup" in runs:
+            runs["startup"].append(measure("startup", project_path, *jobs))
+        if "warm_build" in runs:
+            runs["warm_build"].append(measure("warm_build", project_path, *jobs))
+        if "watch_rebuild" in runs:
+            runs["watch_rebuild"].append(
+                measure(
+                    "watch_rebuild",
+                    project_path,
+                    *jobs,
+                    "--partial",
+                    shape.leaf_partial(),
+                    "--iterations",
+                    str(args.iterations),
+                )
+            )
+        if "serve" in runs:
+            for cache_mb, name in [(0, "serve"), (args.cache_mb, "serve_cached")]:
+                result = measure(
+                    "serve",
+                    project_path,
+                    "--requests",
+                    str(args.requests),
+                    "--concurrency",
+                    str(args.concurrency),
+                    "--cache-mb",
+                    str(cache_mb),
+                )
+                runs.setdefault(name, []).append(result)
+    return runs
+
+
+def summarize(runs: dict[str, list[dict]]) -> dict[str, dict[str, float]]:
+    """The median of every metric across the repeats of each scenario."""
+    return {
+        scenario: {
+            metric: statistics.median(run[metric] for run in scenario_runs)
+            for metric in scenario_runs[0]
+        }
+        for scenario, scenario_runs in runs.items()
+        if scenario_runs
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list[str]:
+    """Prints how each metric changed, returning the ones that regressed."""
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for scenario, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            old_value = baseline["results"].get(scenario, {}).get(metric)
+            if not old_value:
+                continue
+            change = (value - old_value) / old_value
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            regressed = metric not in UNCOMPARED and worse > threshold
+            name = f"{scenario}.{metric}"
+            print(
+                f"{name:<40} {old_value:>12.4f} {value:>12.4f} {change:>+7.1%}"
+                + ("  REGRESSED" if regressed else "")
+            )
+            if regressed:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=__doc__.strip()
+    )
+    defaults = SiteShape()
+    shape_args = parser.add_argument_group("site shape")
+    for shape_field in fields(SiteShape):
+        shape_args.add_argument(
+            f"--{shape_field.name.replace('_', '-')}",
+            type=int,
+            default=getattr(defaults, shape_field.name),
+        )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Processes to build with. Defaults to the CPU count.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs of every scenario; the median is reported.",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=5,
+        help="Partial changes timed per watch_rebuild run.",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=2000, help="Requests sent per serve run."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Concurrent connections per serve run.",
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=64,
+        help="In-memory cache size for the serve_cached run.",
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+    )
+    parser.add_argument(
+        "--project",
+        type=Path,
+        default=None,
+        help=(
+            "Generate the project here and keep it, instead of in a temporary "
+            "directory. Only an empty directory or one generated by an earlier "
+            "run is used."
+        ),
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="Defaults to 'benchmarks/results/<commit>.json'.",
+    )
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="Earlier results to compare against."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression.",
+    )
+    args = parser.parse_args()
+
+    shape = SiteShape(**{f.name: getattr(args, f.name) for f in fields(SiteShape)})
+    if shape.pages < 1 or shape.sections < 1 or shape.include_depth < 1:
+        parser.error("--pages, --sections and --include-depth must be at least 1")
+    with tempfile.TemporaryDirectory(prefix="jinja2static-bench-") as tmp_dir:
+        project_path = args.project or Path(tmp_dir) / "site"
+        print(f"Generating {shape} in '{project_path}'...", file=sys.stderr)
+        try:
+            generate_site(project_path, shape)
+        except FileExistsError as e:
+            parser.error(str(e))
+        runs = run_scenarios(project_path, shape, args)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "jobs": args.jobs,
+        "shape": asdict(shape),
+        "results": summarize(runs),
+        "runs": runs,
+    }
+    output = args.output or BENCHMARKS_PATH / "results" / f"{commit or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Saved results to '{output}'", file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline["shape"] != results["shape"]:
+            print(
+                "WARNING: comparing results of differently shaped sites",
+                file=sys.stderr,
+            )
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+    else:
+        print(json.dumps(results["results"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
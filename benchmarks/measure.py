@@ -0,0 +1,232 @@
+"""
+Runs a single benchmark scenario against a project and prints its metrics as
+JSON. Each scenario runs in a fresh process, so startup costs and peak memory
+are measured the way the CLI would incur them:
+
+    python -m benchmarks.measure cold_build path/to/project --jobs 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def _rss_mb(who: int) -> float:
+    # Kilobytes on Linux, bytes on macOS.
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _quiet_logging():
+    logger = logging.getLogger("jinja2static")
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.ERROR)
+
+
+def _run_cli(*args: str) -> float:
+    """Runs the jinja2static CLI in a fresh interpreter, returning its wall time."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-m", "jinja2static", *args],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(f"'jinja2static {' '.join(args)}' failed:\n{process.stderr}")
+    return elapsed
+
+
+def startup(args) -> dict:
+    """
+    Times the CLI the way users run it: printing its help, and an incremental
+    build of the already built project, which has nothing to do besides
+    starting up and checking the manifest.
+    """
+    jobs = ["--jobs", str(args.jobs)] if args.jobs else []
+    help_s = _run_cli("--help")
+    build_s = _run_cli("build", str(args.project), "--incremental", *jobs)
+    return {"help_s": help_s, "startup_s": build_s}
+
+
+def cold_build(args) -> dict:
+    from jinja2static import Config, build
+
+    _quiet_logging()
+    start = time.perf_counter()
+    config = Config.from_(args.project)
+    if not build(config, jobs=args.jobs):
+        raise RuntimeError("Build failed")
+    return {"build_s": time.perf_counter() - start}
+
+
+def warm_build(args) -> dict:
+    from jinja2static import Config, build
+
+    _quiet_logging()
+    start = time.perf_counter()
+    config = Config.from_(args.project)
+    if not build(config, jobs=args.jobs, incremental=True):
+        raise RuntimeError("Build failed")
+    return {"build_s": time.perf_counter() - start}
+
+
+async def _wait_for_outputs(outputs: set[Path], marker: str, timeout: float):
+    """Waits until every output contains 'marker'."""
+    deadline = time.perf_counter() + timeout
+    pending = set(outputs)
+    while True:
+        pending = {
+            output
+            for output in pending
+            if not output.exists() or marker not in output.read_text()
+        }
+        if not pending:
+            return
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"{len(pending)} outputs were not rebuilt in time")
+        await asyncio.sleep(0.001)
+
+
+async def _watch_rebuild(args) -> dict:
+    from jinja2static import Config, build
+    from jinja2static.watch import watch
+
+    _quiet_logging()
+    config = Config.from_(args.project)
+    build(config, jobs=args.jobs, incremental=True)
+    partial = config.templates / args.partial
+    outputs = {
+        config.output_path_for(page) for page in config.get_dependencies(partial)
+    }
+    original = partial.read_text()
+    watcher = asyncio.create_task(watch(config, args.jobs))
+    latencies = []
+    try:
+        # The first change is untimed, and only waits for the watcher to start.
+        for index in range(-1, args.iterations):
+            marker = f"<!-- {index} -->"
+            if index < 0:
+                await asyncio.sleep(0.5)
+            partial.write_text(f"{original}{marker}\n")
+            start = time.perf_counter()
+            await _wait_for_outputs(outputs, marker, timeout=60)
+            if index >= 0:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        partial.write_text(original)
+    return {
+        "pages_rebuilt": len(outputs),
+        "latency_s": statistics.median(latencies),
+        "latency_max_s": max(latencies),
+    }
+
+
+def watch_rebuild(args) -> dict:
+    """
+    Times how long a running watcher takes from a change to one partial until
+    every page including it has been rewritten, debounce delay included.
+    """
+    return asyncio.run(_watch_rebuild(args))
+
+
+async def _fetch(port: int, paths: list[str], requests: int) -> int:
+    """Sends 'requests' keep-alive requests over one connection, returning the bytes read."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    received = 0
+    try:
+        for index in range(requests):
+            path = paths[index % len(paths)]
+            writer.write(f"GET /{path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            head = await reader.readuntil(b"\r\n\r\n")
+            if not head.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(f"Unexpected response to '{path}': {head!r}")
+            for line in head.decode("latin-1").split("\r\n"):
+                name, _, value = line.partition(":")
+                if name.lower() == "content-length":
+                    received += len(await reader.readexactly(int(value)))
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return received
+
+
+async def _serve_throughput(args) -> dict:
+    from jinja2static import Config
+    from jinja2static.serve import serve
+
+    _quiet_logging()
+    config = Config.from_(args.project)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = asyncio.create_task(serve(port, config, args.cache_mb))
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.05)
+    paths = [
+        file_path.relative_to(config.dist).as_posix()
+        for file_path in sorted(config.dist.rglob("*.html"))
+    ]
+    per_connection = args.requests // args.concurrency
+    start = time.perf_counter()
+    received = await asyncio.gather(
+        *(_fetch(port, paths, per_connection) for _ in range(args.concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    server.cancel()
+    requests = per_connection * args.concurrency
+    return {
+        "requests_per_s": requests / elapsed,
+        "mb_per_s": sum(received) / elapsed / (1024 * 1024),
+    }
+
+
+def serve_throughput(args) -> dict:
+    return asyncio.run(_serve_throughput(args))
+
+
+SCENARIOS = {
+    "startup": startup,
+    "cold_build": cold_build,
+    "warm_build": warm_build,
+    "watch_rebuild": watch_rebuild,
+    "serve": serve_throughput,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("project", type=Path)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--partial", default=None)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cache-mb", type=int, default=0)
+    args = parser.parse_args()
+    metrics = SCENARIOS[args.scenario](args)
+    metrics["peak_rss_mb"] = _rss_mb(resource.RUSAGE_SELF)
+    metrics["peak_worker_rss_mb"] = _rss_mb(resource.RUSAGE_CHILDREN)
+    print(json.dumps(metrics))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Generates synthetic jinja2static projects to benchmark against.
+"""
+
+from __future__ import annotations
+
+import random
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+
+PYPROJECT = """[tools.jinja2static]
+templates="templates"
+assets="assets"
+dist="dist"
+data="data"
+"""
+
+DATA_MODULE = """from jinja2static.data import per_page_data
+
+
+@per_page_data
+def page_data(data, config, file_path):
+    return {"page_name": file_path.stem}
+"""
+
+BASE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>{{ title }} - {{ page_name }}</title></head>
+<body>
+{% block content %}{% endblock %}
+</body>
+</html>
+"""
+
+MACROS_TEMPLATE = """{% macro card(item, index) -%}
+<article class="card-{{ index }}">
+  <h2>{{ item.title | title }}</h2>
+  <p>{{ item.body | truncate(80) }}</p>
+  <ul>{% for tag in item.tags %}<li>{{ tag }}</li>{% endfor %}</ul>
+</article>
+{%- endmacro %}
+"""
+
+PAGE_TEMPLATE = """{{% extends "_base.html" %}}
+{{% import "_macros.html" as macros %}}
+{{% block content %}}
+{{% include "_section_{section}_level_0.html" %}}
+{{% for index in range({fanout}) %}}
+{{{{ macros.card(items[(index + {offset}) % items | length], index) }}}}
+{{% endfor %}}
+{{% endblock %}}
+"""
+
+# Written into every generated project, so only those are ever replaced.
+MARKER_FILE_NAME = ".jinja2static-benchmark"
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+
+
+@dataclass
+class SiteShape:
+    """The size of a synthetic project along each dimension that affects builds."""
+
+    pages: int = field(default=200)
+    # Pages are split evenly between sections, each with its own chain of
+    # nested includes, so a partial is shared by a fraction of the pages.
+    sections: int = field(default=10)
+    include_depth: int = field(default=4)
+    macro_fanout: int = field(default=20)
+    data_items: int = field(default=200)
+    assets: int = field(default=100)
+    asset_kb: int = field(default=16)
+    seed: int = field(default=0)
+
+    def leaf_partial(self, section: int = 0) -> str:
+        """The innermost partial of a section, included by all of its pages."""
+        return f"_section_{section}_level_{self.include_depth - 1}.html"
+
+    def page_outputs(self) -> list[str]:
+        return [
+            f"section_{index % self.sections}/page_{index}.html"
+            for index in range(self.pages)
+        ]
+
+
+def _write(file_path: Path, content: str | bytes):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(content, bytes):
+        file_path.write_bytes(content)
+    else:
+        file_path.write_text(content)
+
+
+def generate_site(project_path: Path, shape: SiteShape) -> Path:
+    """
+    Writes a project of the given shape to 'project_path'. A project this
+    function generated before is replaced, but any other non-empty directory
+    is left alone and raises FileExistsError.
+    """
+    if project_path.is_dir() and any(project_path.iterdir()):
+        if not (project_path / MARKER_FILE_NAME).is_file():
+            raise FileExistsError(
+                f"'{project_path}' is not empty and was not generated by the benchmarks"
+            )
+        shutil.rmtree(project_path)
+    rng = random.Random(shape.seed)
+    templates = project_path / "templates"
+    _write(project_path / MARKER_FILE_NAME, "")
+    _write(project_path / "pyproject.toml", PYPROJECT)
+    _write(project_path / "data" / "__init__.py", DATA_MODULE)
+    items = [
+        {
+            "title": " ".join(rng.choices(WORDS, k=4)),
+            "body": " ".join(rng.choices(WORDS, k=40)),
+            "tags": rng.sample(WORDS, k=3),
+        }
+        for _ in range(shape.data_items)
+    ]
+    _write(
+        project_path / "data" / "__init__.yaml",
+        yaml.safe_dump({"title": "Benchmark", "items": items}),
+    )
+
+    _write(templates / "_base.html", BASE_TEMPLATE)
+    _write(templates / "_macros.html", MACROS_TEMPLATE)
+    for section in range(shape.sections):
+        for level in range(shape.include_depth):
+            if level + 1 < shape.include_depth:
+                inner = f'{{% include "_section_{section}_level_{level + 1}.html" %}}'
+            else:
+                inner = "<p>{{ title }}: {{ page_name }}</p>"
+            _write(
+                templates / f"_section_{section}_level_{level}.html",
+                f'<div class="level-{level}">{inner}</div>\n',
+            )
+    for index, output in enumerate(shape.page_outputs()):
+        _write(
+            templates / output,
+            PAGE_TEMPLATE.format(
+                section=index % shape.sections,
+                fanout=shape.macro_fanout,
+                offset=index,
+            ),
+        )
+
+    for index in range(shape.assets):
+        _write(
+            project_path / "assets" / "static" / f"asset_{index}.bin",
+            rng.randbytes(shape.asset_kb * 1024),
+        )
+    return project_path
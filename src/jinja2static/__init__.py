@@ -1,22 +1,73 @@
-import argparse
 import logging
-from asyncio import CancelledError, create_task, gather, run, sleep
+import sys
+from collections.abc import Coroutine
 from functools import wraps
+from importlib import import_module
 from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING
 
-from .build import build
-from .config import Config
-from .init import initialize_project
-from .logger import configure_logging
-from .serve import serve
-from .watch import watch
+if TYPE_CHECKING:
+    from .build import build
+    from .config import Config
+    from .init import initialize_project
+    from .logger import configure_logging
+    from .serve import serve
+    from .watch import watch
+
+__all__ = [
+    "Config",
+    "build",
+    "configure_logging",
+    "initialize_project",
+    "main",
+    "serve",
+    "watch",
+]
 
 logger = logging.getLogger(__name__)
 
+# Public names and the modules they are imported from on first use, so
+# importing the package (and running a subcommand) only loads what is used.
+LAZY_ATTRIBUTES = {
+    "build": ".build",
+    "Config": ".config",
+    "initialize_project": ".init",
+    "configure_logging": ".logger",
+    "serve": ".serve",
+    "watch": ".watch",
+}
+
+
+def __getattr__(name: str):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    value = getattr(import_module(LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *LAZY_ATTRIBUTES})
+
+
+class _Package(ModuleType):
+    def __setattr__(self, name: str, value):
+        # Importing the 'build', 'serve' and 'watch' submodules binds them on
+        # the package, which would shadow the functions of the same names.
+        if name in LAZY_ATTRIBUTES and isinstance(value, ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
 
 def allow_cancel(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
+        from asyncio import CancelledError
+
         try:
             return await func(*args, **kwargs)
         except CancelledError:
@@ -25,32 +76,74 @@ def allow_cancel(func):
     return wrapper
 
 
-@allow_cancel
-async def initialize(config, _):
+def initialize(config: "Config", _):
+    from .init import initialize_project
+
     initialize_project(config)
 
 
-@allow_cancel
-async def build_from_project_path(config: Config, _):
-    return build(config)
+def profile_path_for(config: "Config", args) -> Path | None:
+    if args.profile_trace:
+        return args.profile_trace
+    if args.profile:
+        return config.cache / "profile.json"
+    return None
+
+
+def trace_file_path(value: str) -> Path:
+    """Parses a trace file argument, rejecting directories before anything is built."""
+    file_path = Path(value)
+    if file_path.is_dir():
+        from argparse import ArgumentTypeError
+
+        raise ArgumentTypeError(f"'{value}' is a directory, expected a file")
+    return file_path
+
+
+def build_from_project_path(config: "Config", args):
+    from .build import build
+
+    config.compress = config.compress or args.compress
+    return build(
+        config,
+        jobs=args.jobs,
+        incremental=args.incremental,
+        profile=profile_path_for(config, args),
+    )
 
 
 @allow_cancel
-async def run_watcher(config: Config, _):
-    return await watch(config)
+async def run_watcher(config: "Config", args):
+    from .watch import watch
+
+    return await watch(config, args.jobs)
 
 
 @allow_cancel
-async def run_serve(config: Config, args):
-    return await serve(args.port, config)
+async def run_serve(config: "Config", args):
+    from .serve import serve
+
+    return await serve(args.port, config, args.cache_mb)
 
 
 @allow_cancel
-async def run_dev_server(config: Config, args):
-    build(config)
-    task = create_task(serve(args.port, config))
+async def run_dev_server(config: "Config", args):
+    from asyncio import create_task, gather, sleep
+
+    from .build import build
+    from .serve import serve
+    from .watch import watch
+
+    config.compress = config.compress or args.compress
+    build(
+        config,
+        jobs=args.jobs,
+        incremental=args.incremental,
+        profile=profile_path_for(config, args),
+    )
+    task = create_task(serve(args.port, config, args.cache_mb, live_reload=True))
     await sleep(1)
-    create_task(watch(config))
+    create_task(watch(config, args.jobs))
     await gather(task)
 
 
@@ -83,17 +176,89 @@ PORT_ARG = (
     },
 )
 
+CACHE_ARG = (
+    ["--cache-mb"],
+    {
+        "help": "Keep up to this many MB of served files in memory (0 disables caching).",
+        "required": False,
+        "default": 0,
+        "type": int,
+    },
+)
+
+JOBS_ARG = (
+    ["-j", "--jobs"],
+    {
+        "help": "Number of processes to render pages with. Defaults to the CPU count.",
+        "required": False,
+        "default": None,
+        "type": int,
+    },
+)
+
+INCREMENTAL_ARG = (
+    ["-i", "--incremental"],
+    {
+        "help": "Only rebuild pages and assets whose inputs changed since the last build.",
+        "default": False,
+        "action": "store_true",
+    },
+)
+
+COMPRESS_ARG = (
+    ["-z", "--compress"],
+    {
+        "help": "Write gzip (and brotli, when installed) variants of compressible outputs.",
+        "default": False,
+        "action": "store_true",
+    },
+)
+
+PROFILE_ARG = (
+    ["--profile"],
+    {
+        "help": "Report the time spent on every page and save a Chrome trace of the build to 'profile.json' in the cache directory.",
+        "default": False,
+        "action": "store_true",
+    },
+)
+
+PROFILE_TRACE_ARG = (
+    ["--profile-trace"],
+    {
+        "help": "Profile the build like --profile, saving the Chrome trace to TRACE_FILE instead.",
+        "default": None,
+        "type": trace_file_path,
+        "metavar": "TRACE_FILE",
+    },
+)
+
 DEFAULT_ARGS = [PROJECT_PATH_ARG, VERBOSE_ARG]
 
 MAIN_CLI = {
     "build": {
         "help": "Build a static site from a jinja2static project",
         "func": build_from_project_path,
+        "extra_args": [
+            JOBS_ARG,
+            INCREMENTAL_ARG,
+            COMPRESS_ARG,
+            PROFILE_ARG,
+            PROFILE_TRACE_ARG,
+        ],
     },
     "dev": {
         "help": "Run a development server that watches and recompiles src files.",
         "func": run_dev_server,
-        "extra_args": [PORT_ARG],
+        "extra_args": [
+            PORT_ARG,
+            CACHE_ARG,
+            JOBS_ARG,
+            INCREMENTAL_ARG,
+            COMPRESS_ARG,
+            PROFILE_ARG,
+            PROFILE_TRACE_ARG,
+        ],
     },
     "init": {
         "help": "initializes a project be configured as a jinja2static project.",
@@ -102,16 +267,19 @@ MAIN_CLI = {
     "serve": {
         "help": "Serves the built files in the 'dist' directory.",
         "func": run_serve,
-        "extra_args": [PORT_ARG],
+        "extra_args": [PORT_ARG, CACHE_ARG],
     },
     "watch": {
         "help": "Watches and recompiles src files (no server)",
         "func": run_watcher,
+        "extra_args": [JOBS_ARG],
     },
 }
 
 
 def main():
+    import argparse
+
     jinja2static = argparse.ArgumentParser(description="Jinja2Static")
     subcommands = jinja2static.add_subparsers(
         dest="command", help="Available subcommands"
@@ -130,13 +298,20 @@ def main():
             subcmd.add_argument(*args, **kwargs)
 
     cli_args = jinja2static.parse_args()
+    from .config import Config
+    from .logger import configure_logging
+
     configure_logging(cli_args.verbose)
     cmd_name = getattr(cli_args, "command", None)
     config = Config.from_(
         cli_args.project_file_path, create_if_missing=cmd_name == "init"
     )
     if hasattr(cli_args, "func") and config:
-        run(cli_args.func(config, cli_args))
+        result = cli_args.func(config, cli_args)
+        if isinstance(result, Coroutine):
+            from asyncio import run
+
+            run(result)
     elif not config:
         return
     else:
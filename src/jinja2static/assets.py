@@ -1,26 +1,132 @@
 from __future__ import annotations
 
 import logging
+import os
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import TYPE_CHECKING
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
 if TYPE_CHECKING:
     from .config import Config
 
 logger = logging.getLogger(__name__)
 
+# Values of the 'asset_copy_mode' setting.
+ASSET_COPY_MODES = ("auto", "hardlink", "copy")
+
+# ioctl request cloning a file's extents on copy-on-write filesystems (Linux).
+FICLONE = 0x40049409
+
+
+def is_unchanged(src_stat: os.stat_result, dst_file_path: Path) -> bool:
+    try:
+        dst_stat = dst_file_path.stat()
+    except FileNotFoundError:
+        return False
+    if os.path.samestat(src_stat, dst_stat):
+        return True
+    return (src_stat.st_size, src_stat.st_mtime_ns) == (
+        dst_stat.st_size,
+        dst_stat.st_mtime_ns,
+    )
+
+
+def clone_file(src_file_path: Path, dst_file_path: Path):
+    """
+    Copies the file's contents with the cheapest mechanism available: a reflink
+    on copy-on-write filesystems, then an in-kernel copy_file_range, then
+    shutil (which uses sendfile where it can).
+    """
+    with open(src_file_path, "rb") as src, open(dst_file_path, "wb") as dst:
+        if fcntl:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+                return
+            except OSError:
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst)
+
+
+def copy_file(src_file_path: Path, dst_file_path: Path, mode: str = "auto"):
+    """
+    Copies 'src_file_path' to 'dst_file_path' through a temporary file, so the
+    destination is replaced atomically. Modification times are preserved,
+    which is what later syncs compare against.
+    """
+    dst_file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file_path = dst_file_path.with_name(
+        f".{dst_file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        if mode == "hardlink":
+            try:
+                os.link(src_file_path, tmp_file_path)
+                os.replace(tmp_file_path, dst_file_path)
+                return
+            except OSError as e:
+                logger.debug(f"Unable to hardlink '{src_file_path}': {e}")
+        if mode == "copy":
+            shutil.copyfile(src_file_path, tmp_file_path)
+        else:
+            clone_file(src_file_path, tmp_file_path)
+        shutil.copystat(src_file_path, tmp_file_path)
+        os.replace(tmp_file_path, dst_file_path)
+    finally:
+        tmp_file_path.unlink(missing_ok=True)
+
 
-def copy_asset_dir(config: Config):
+def copy_asset_dir(config: Config) -> dict[str, list[int]]:
+    """
+    Syncs assets into the distribution directory, skipping the ones whose
+    size and modification time already match their copy. Returns the size
+    and modification time of every asset.
+    """
     logger.info(f"Copying assets '{config.assets}' => '{config.dist}'")
     config.dist.mkdir(parents=True, exist_ok=True)
-    shutil.copytree(config.assets, config.dist, dirs_exist_ok=True)
+    assets = {}
+    to_copy = []
+    for dir_path, _, file_names in os.walk(config.assets):
+        for file_name in file_names:
+            src_file_path = Path(dir_path) / file_name
+            file_path = src_file_path.relative_to(config.assets).as_posix()
+            stat = src_file_path.stat()
+            assets[file_path] = [stat.st_size, stat.st_mtime_ns]
+            dst_file_path = config.dist / file_path
+            if not is_unchanged(stat, dst_file_path):
+                to_copy.append((src_file_path, dst_file_path))
+    if to_copy:
+        with ThreadPoolExecutor() as executor:
+            list(
+                executor.map(
+                    lambda paths: copy_file(*paths, config.asset_copy_mode), to_copy
+                )
+            )
+    logger.debug(f"Copied {len(to_copy)} of {len(assets)} assets")
+    return assets
 
 
 def copy_asset_file(config: Config, file_path: str):
     config.dist.mkdir(parents=True, exist_ok=True)
     src_file_path = config.assets / file_path
     dst_file_path = config.dist / file_path
-    shutil.copy(src_file_path, dst_file_path)
+    copy_file(src_file_path, dst_file_path, config.asset_copy_mode)
     logger.info(
         f"Copied '{src_file_path.relative_to(config.project_path)}' -> {dst_file_path.relative_to(config.project_path)}"
     )
@@ -1,24 +1,106 @@
 import logging
-import shutil
+import os
 import time
+from pathlib import Path
 
 from .assets import copy_asset_dir
+from .compress import compress_outputs, compressed_outputs
 from .config import Config
+from .generate import build_generated_pages
+from .manifest import BuildManifest
+from .profiler import disable_profiling, enable_profiling, span
 from .templates import build_pages
 
 logger = logging.getLogger(__name__)
 
 
-def build(config: Config | None) -> bool:
+def prune_dist(config: Config, outputs: set[str]):
+    """
+    Removes the files in the distribution directory that the build did not
+    produce, along with any directories left empty.
+    """
+    for dir_path, _, file_names in os.walk(config.dist, topdown=False):
+        dir_path = Path(dir_path)
+        for file_name in file_names:
+            file_path = dir_path / file_name
+            if file_path.relative_to(config.dist).as_posix() not in outputs:
+                logger.debug(f"Removing orphaned output '{file_path}'")
+                file_path.unlink()
+        if dir_path != config.dist and not any(dir_path.iterdir()):
+            dir_path.rmdir()
+
+
+def build(
+    config: Config | None,
+    jobs: int | None = None,
+    incremental: bool = False,
+    profile: Path | None = None,
+) -> bool:
+    """
+    Builds the project. With 'profile', the time spent on every page is
+    reported once done and saved as a Chrome trace to that file.
+    """
     if not config:
         return False
-    if config.dist.exists():
-        logger.debug(f"Removing '{config.dist}'")
-        shutil.rmtree(config.dist)
+    if not profile:
+        return _build(config, jobs, incremental)
+    profiler = enable_profiling()
+    try:
+        return _build(config, jobs, incremental)
+    finally:
+        disable_profiling()
+        logger.info(f"Build profile:\n{profiler.report(config)}")
+        profiler.save_trace(profile)
+        logger.info(f"Saved build trace to '{profile}'")
+
+
+def _build(config: Config, jobs: int | None, incremental: bool) -> bool:
+    manifest = BuildManifest.load(config) if incremental else None
+    if incremental and not manifest:
+        logger.info("No usable build manifest found, doing a full build.")
+    if not manifest:
+        manifest = BuildManifest(config=config)
     start_time = time.perf_counter()
     logger.info("Building...")
-    copy_asset_dir(config)
-    if not build_pages(config):
+    with span("assets", "copy_asset_dir"):
+        manifest.assets = copy_asset_dir(config)
+
+    pages = {
+        page.relative_to(config.templates).as_posix(): page for page in config.pages
+    }
+    inputs = {page: manifest.page_inputs(page) for page in pages.values()}
+    stale_pages = [
+        page for page in pages.values() if manifest.is_stale(page, inputs[page])
+    ]
+    if len(stale_pages) < len(pages):
+        logger.info(f"Skipping {len(pages) - len(stale_pages)} unchanged pages.")
+    # Skipped pages keep the data they read when they were last rendered.
+    for output, page in pages.items():
+        if output in manifest.data_access:
+            config.record_data_access(page, set(manifest.data_access[output]))
+    results = build_pages(config, jobs, stale_pages)
+    generated = build_generated_pages(config, jobs)
+    config.generated_outputs = set(generated)
+    outputs = {*manifest.assets, *pages, *generated}
+    manifest.compressed = (
+        compress_outputs(config, outputs, manifest.compressed)
+        if config.compress
+        else {}
+    )
+    prune_dist(config, {*outputs, *compressed_outputs(set(manifest.compressed))})
+    # Failed pages are recorded without inputs so the next build retries them.
+    manifest.pages = {
+        output: inputs[page] if results.get(page, True) else {}
+        for output, page in pages.items()
+    }
+    manifest.data_access = {
+        output: sorted(names)
+        for output, page in pages.items()
+        if (names := config.data_access_for(page)) is not None
+    }
+    manifest.save()
+    config.reference_cache.save()
+    if not all(results.values()) or not all(generated.values()):
         return False
     end_time = time.perf_counter()
     logger.info(f"Successfully built in {(end_time - start_time):.4f} seconds.")
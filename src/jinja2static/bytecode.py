@@ -0,0 +1,84 @@
+"""
+Persistent cache of compiled templates, shared between runs.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+
+import jinja2
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE_PATTERN = "%s.cache"
+
+
+class BoundedBytecodeCache(FileSystemBytecodeCache):
+    """
+    Filesystem bytecode cache that evicts the least recently used templates
+    once the cache directory grows past 'max_size' bytes.
+
+    Buckets are keyed on the Jinja2 version, and Jinja2 itself discards cached
+    bytecode whose source checksum no longer matches the template.
+    """
+
+    def __init__(self, directory: Path, max_size: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory), CACHE_FILE_PATTERN)
+        self.max_size = max_size
+        self._size: int | None = None
+
+    def get_cache_key(self, name: str, filename: str | None = None) -> str:
+        return super().get_cache_key(f"{jinja2.__version__}:{name}", filename)
+
+    def load_bytecode(self, bucket: Bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            return
+        try:
+            # Mark the entry as recently used for eviction.
+            os.utime(self._get_cache_filename(bucket))
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket: Bucket):
+        file_path = Path(self._get_cache_filename(bucket))
+        previous_size = file_path.stat().st_size if file_path.exists() else 0
+        super().dump_bytecode(bucket)
+        if self._size is None:
+            self._size = sum(size for _, _, size in self.cache_files())
+        elif file_path.exists():
+            self._size += file_path.stat().st_size - previous_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def cache_files(self) -> list[tuple[Path, int, int]]:
+        cache_files = []
+        suffix = CACHE_FILE_PATTERN % ""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                cache_files.append((Path(entry.path), stat.st_mtime_ns, stat.st_size))
+        return cache_files
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is 80% full."""
+        cache_files = sorted(self.cache_files(), key=lambda cache_file: cache_file[1])
+        self._size = sum(size for _, _, size in cache_files)
+        target_size = self.max_size * 0.8
+        evicted = 0
+        for file_path, _, size in cache_files:
+            if self._size <= target_size:
+                break
+            file_path.unlink(missing_ok=True)
+            self._size -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} compiled templates from '{self.directory}'")
@@ -0,0 +1,149 @@
+"""
+Precompressed (gzip and, when available, brotli) variants of build outputs.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .output import file_hash
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_SUFFIXES = {
+    ".html",
+    ".htm",
+    ".css",
+    ".js",
+    ".mjs",
+    ".json",
+    ".map",
+    ".xml",
+    ".svg",
+    ".txt",
+    ".csv",
+    ".md",
+    ".wasm",
+}
+
+# Preferred encodings first.
+ENCODERS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {
+    **({"br": (".br", brotli.compress)} if brotli else {}),
+    "gzip": (".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+}
+
+
+def is_compressible(file_path: Path) -> bool:
+    return file_path.suffix.lower() in COMPRESSIBLE_SUFFIXES
+
+
+def variant_path(file_path: Path, encoding: str) -> Path:
+    suffix, _ = ENCODERS[encoding]
+    return file_path.with_name(file_path.name + suffix)
+
+
+def compress_file(file_path: Path) -> list[str]:
+    """
+    Writes a compressed variant of 'file_path' for every available encoding.
+    Variants share the original's modification time, which is how the server
+    tells them apart from stale ones. Variants that would not be smaller than
+    the original are removed instead. Returns the encodings written.
+    """
+    data = file_path.read_bytes()
+    stat = file_path.stat()
+    encodings = []
+    for encoding, (_, encode) in ENCODERS.items():
+        dst_file_path = variant_path(file_path, encoding)
+        compressed = encode(data)
+        if len(compressed) >= len(data):
+            dst_file_path.unlink(missing_ok=True)
+            continue
+        tmp_file_path = dst_file_path.with_name(f".{dst_file_path.name}.tmp")
+        tmp_file_path.write_bytes(compressed)
+        os.utime(tmp_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_file_path, dst_file_path)
+        encodings.append(encoding)
+    return encodings
+
+
+def has_variants(file_path: Path, encodings: list[str]) -> bool:
+    return all(variant_path(file_path, encoding).is_file() for encoding in encodings)
+
+
+def compress_outputs(
+    config: Config, outputs: set[str], previous: dict[str, list] | None = None
+) -> dict[str, list]:
+    """
+    Compresses the compressible 'outputs' in parallel, skipping the ones whose
+    content hash matches 'previous' and whose variants are all still there.
+    Returns the size, modification time, hash and encodings written of every
+    compressible output.
+    """
+    previous = previous or {}
+    compressed = {}
+    to_compress = []
+    for output in outputs:
+        file_path = config.dist / output
+        if not is_compressible(file_path):
+            continue
+        stat = file_path.stat()
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        previous_state = previous.get(output, [])
+        # Outputs missing a variant are compressed again.
+        if len(previous_state) != 4 or not has_variants(file_path, previous_state[3]):
+            previous_state = []
+        if previous_state[:2] == fingerprint:
+            compressed[output] = previous_state
+            continue
+        digest = file_hash(file_path)
+        if previous_state[2:3] == [digest]:
+            # Rewritten with the same content, the variants only need its mtime.
+            for encoding in previous_state[3]:
+                os.utime(
+                    variant_path(file_path, encoding),
+                    ns=(stat.st_atime_ns, stat.st_mtime_ns),
+                )
+            compressed[output] = [*fingerprint, digest, previous_state[3]]
+            continue
+        compressed[output] = [*fingerprint, digest]
+        to_compress.append(output)
+    if to_compress:
+        logger.info(f"Compressing {len(to_compress)} files...")
+    with ThreadPoolExecutor() as executor:
+        file_paths = [config.dist / output for output in to_compress]
+        for output, encodings in zip(
+            to_compress, executor.map(compress_file, file_paths)
+        ):
+            compressed[output].append(encodings)
+    return compressed
+
+
+def compress_changed_outputs(file_paths: set[Path]):
+    """Recompresses the outputs the watcher rewrote, dropping deleted ones' variants."""
+    for file_path in file_paths:
+        if not is_compressible(file_path):
+            continue
+        if file_path.is_file():
+            compress_file(file_path)
+            continue
+        for encoding in ENCODERS:
+            variant_path(file_path, encoding).unlink(missing_ok=True)
+
+
+def compressed_outputs(outputs: set[str]) -> set[str]:
+    return {output + suffix for output in outputs for suffix, _ in ENCODERS.values()}
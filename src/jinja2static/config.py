@@ -1,7 +1,11 @@
 import logging
+import os
+import weakref
 from collections import defaultdict
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass, field
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 try:
     import tomllib
@@ -9,8 +13,11 @@ except ImportError:
     # Python < 3.11
     import tomli as tomllib
 
-from .data import DataModule
-from .templates import find_all_subtemplates
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+    from .data import DataModule
+    from .templates import ReferenceCache
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +29,11 @@ class Config:
     assets: Path = field()
     dist: Path = field()
     data: Path = field()
+    cache: Path = field()
+    bytecode_cache_mb: int = field(default=64)
+    asset_copy_mode: str = field(default="auto")
+    compress: bool = field(default=False)
+    debounce_ms: int = field(default=50)
 
     @classmethod
     def from_(cls, file_path_str: str | None = None, create_if_missing: bool = False):
@@ -59,50 +71,270 @@ class Config:
             "assets": project_path / "assets",
             "dist": project_path / "dist",
             "data": project_path / "data",
+            "cache": project_path / ".jinja2static",
         }
         config_data = pyproject_data.get("tools", {}).get("jinja2static", {})
+        if error := cls.invalid_setting(config_data):
+            logger.error(f"Invalid configuration in '{pyproject_path}': {error}")
+            return None
         config_data = {
             k: (project_path / Path(v)).absolute()
+            if cls.__dataclass_fields__[k].type is Path
+            else v
             for k, v in config_data.items()
             if k in [k for k in cls.__dataclass_fields__.keys()]
         }
         kwargs = {**default_config_data, **config_data}
         logger.debug(f"Config data loaded: {kwargs}")
-        config = cls(project_path=project_path, **kwargs)
-        for page in config.pages:
-            config.update_dependency_graph(page)
-        return config
+        # Templates, data and the dependency graph are only read once needed.
+        return cls(project_path=project_path, **kwargs)
+
+    @classmethod
+    def invalid_setting(cls, config_data: dict) -> str | None:
+        """Describes the first setting in 'config_data' with an invalid value."""
+        from .assets import ASSET_COPY_MODES
+
+        for key, value in config_data.items():
+            if key not in cls.__dataclass_fields__:
+                continue
+            expected = cls.__dataclass_fields__[key].type
+            if expected is Path:
+                expected = str
+            # TOML booleans are ints to Python, but not valid numbers here.
+            if not isinstance(value, expected) or (
+                expected is int and isinstance(value, bool)
+            ):
+                return f"'{key}' must be of type {expected.__name__}, got {value!r}"
+            if expected is int and value < 0:
+                return f"'{key}' must not be negative, got {value!r}"
+            if key == "asset_copy_mode" and value not in ASSET_COPY_MODES:
+                return f"'{key}' must be one of {list(ASSET_COPY_MODES)}, got {value!r}"
+        return None
 
     def __post_init__(self):
-        self.data_module = DataModule(config=self, file_path=self.data)
+        self._references: dict[Path, set[Path]] = {}
+        self._referenced_by: dict[Path, set[Path]] = defaultdict(set)
+        self._output_listeners: list[Callable[[set[Path]], None]] = []
+        self._data_access: dict[Path, set[str]] = {}
+        # Outputs of the last run of the data module's page generators.
+        self.generated_outputs: set[str] = set()
+
+    _pages = None
 
     @property
-    def pages(self) -> list[str]:
-        return [
-            p.absolute()
-            for p in Path(self.templates).rglob("*")
-            if p.is_file() and not p.name.startswith("_")
-        ]
+    def pages(self) -> set[Path]:
+        if self._pages is None:
+            self.update_pages()
+        return self._pages
 
-    _parent_to_child_graph = {}
+    def update_pages(self):
+        self._pages = {p for p in _scan_files(self.templates) if self.is_page(p)}
 
-    def update_dependency_graph(self, file_path: Path):
-        self._parent_to_child_graph[file_path] = find_all_subtemplates(self, file_path)
+    def is_page(self, file_path: Path) -> bool:
+        return file_path.is_relative_to(
+            self.templates
+        ) and not file_path.name.startswith("_")
+
+    def add_page(self, file_path: Path):
+        if self.is_page(file_path) and file_path.is_file():
+            self.pages.add(file_path)
+
+    def remove_page(self, file_path: Path):
+        self.pages.discard(file_path)
+
+    def remove_template(self, file_path: Path) -> set[Path]:
+        """
+        Forgets the template at 'file_path', or every template under it if it
+        was a directory, and returns the templates removed. Templates that
+        referenced a removed one keep that edge, so they are still rebuilt if
+        it comes back.
+        """
+        self.ensure_dependency_graph()
+        removed = {
+            template
+            for template in {*self._references, *self.pages}
+            if template == file_path or file_path in template.parents
+        }
+        if not removed:
+            # Deleted before the project's templates were first read.
+            removed.add(file_path)
+        for template in removed:
+            self.remove_page(template)
+            self.invalidate_template(template)
+            for child in self._references.pop(template, set()):
+                self._referenced_by[child].discard(template)
+            self.reference_cache.discard(template)
+        return removed
+
+    _environment = None
 
     @property
-    def dependency_graph(self):
-        child_to_parent = defaultdict(set)
-        for original_key, value_set in self._parent_to_child_graph.items():
-            for value in value_set:
-                child_to_parent[Path(value)].add(original_key)
-        return dict(child_to_parent)
-
-    def get_dependencies(self, file_path: Path) -> list[str, Path]:
-        return set(
-            dep
-            for dep in self.dependency_graph.get(file_path, set())
-            if dep in self.pages
+    def environment(self) -> "Environment":
+        if not self._environment:
+            self.update_environment()
+        return self._environment
+
+    def update_environment(self):
+        """
+        Creates the Jinja2 environment shared by every page of the project.
+        Templates are only recompiled when the watcher invalidates them, so
+        the cache is sized to hold every template file in the project, and
+        compiled templates are persisted in the bytecode cache between runs.
+        """
+        from jinja2 import Environment
+
+        from .bytecode import BoundedBytecodeCache
+        from .templates import TemplateLoader, TrackingContext
+
+        template_count = sum(1 for _ in _scan_files(self.templates))
+        bytecode_cache = (
+            BoundedBytecodeCache(
+                self.cache / "bytecode", self.bytecode_cache_mb * 1024 * 1024
+            )
+            if self.bytecode_cache_mb > 0
+            else None
+        )
+        self._environment = Environment(
+            loader=TemplateLoader(self.templates),
+            cache_size=max(template_count, 400),
+            auto_reload=False,
+            bytecode_cache=bytecode_cache,
         )
+        self._environment.context_class = TrackingContext
+
+    def invalidate_template(self, file_path: Path):
+        if not self._environment or self._environment.cache is None:
+            return
+        template_name = file_path.relative_to(self.templates).as_posix()
+        cache_key = (weakref.ref(self._environment.loader), template_name)
+        if cache_key in self._environment.cache:
+            logger.debug(f"Invalidating compiled template '{template_name}'")
+            del self._environment.cache[cache_key]
+
+    _reference_cache = None
+
+    @property
+    def reference_cache(self) -> "ReferenceCache":
+        if not self._reference_cache:
+            from .templates import ReferenceCache
+
+            self._reference_cache = ReferenceCache.load(self.cache / "references.json")
+        return self._reference_cache
+
+    def update_dependency_graph(self, file_path: Path):
+        """
+        Re-reads the templates 'file_path' references and updates the
+        reference index in both directions. Referenced templates that have
+        not been read yet are read as well.
+        """
+        unprocessed = [file_path]
+        while unprocessed:
+            current = unprocessed.pop()
+            references = self.reference_cache.references_for(self, current)
+            previous = self._references.get(current, set())
+            for child in previous - references:
+                self._referenced_by[child].discard(current)
+            for child in references - previous:
+                self._referenced_by[child].add(current)
+            self._references[current] = references
+            unprocessed.extend(
+                child
+                for child in references
+                if child not in self._references and child not in unprocessed
+            )
+
+    _dependency_graph_complete = False
+
+    def ensure_dependency_graph(self):
+        """
+        Reads the references of every page not read yet, so the graph knows
+        every template that references a given one.
+        """
+        if self._dependency_graph_complete:
+            return
+        for page in self.pages:
+            if page not in self._references:
+                self.update_dependency_graph(page)
+        self.reference_cache.save()
+        self._dependency_graph_complete = True
+
+    def get_subtemplates(self, file_path: Path) -> set[Path]:
+        """Get 'file_path' and every template it references, transitively."""
+        if file_path not in self._references:
+            self.update_dependency_graph(file_path)
+        return _walk(self._references, file_path)
+
+    def get_dependencies(self, file_path: Path) -> set[Path]:
+        """Get the pages that reference 'file_path', transitively."""
+        self.ensure_dependency_graph()
+        dependents = _walk(self._referenced_by, file_path)
+        dependents.discard(file_path)
+        return {dep for dep in dependents if dep in self.pages}
+
+    _data_module = None
+
+    @property
+    def data_module(self) -> "DataModule":
+        if self._data_module is None:
+            self.update_data_module()
+        return self._data_module
+
+    def update_data_module(self):
+        """Re-reads the data module tree, picking up added and removed data files."""
+        from .data import DataModule
+
+        self._data_module = DataModule(config=self, file_path=self.data)
 
     def data_for(self, file_path: Path):
         return self.data_module.data_for(file_path)
+
+    def record_data_access(self, page: Path, names: set[str] | None):
+        """Records the names 'page' looked up when it was last rendered."""
+        if names is None:
+            self._data_access.pop(page, None)
+        else:
+            self._data_access[page] = names
+
+    def data_access_for(self, page: Path) -> set[str] | None:
+        return self._data_access.get(page)
+
+    def reads_data(self, page: Path, keys: set[str]) -> bool:
+        """Whether 'page' may read any of 'keys', assuming so if unknown."""
+        names = self._data_access.get(page)
+        return names is None or not names.isdisjoint(keys)
+
+    def output_path_for(self, file_path: Path) -> Path:
+        return self.dist / file_path.relative_to(self.templates)
+
+    def on_outputs_changed(self, listener: Callable[[set[Path]], None]):
+        """Registers 'listener' to be called with the outputs the watcher rewrites."""
+        self._output_listeners.append(listener)
+
+    def publish_outputs_changed(self, file_paths: set[Path]):
+        for listener in self._output_listeners:
+            listener(file_paths)
+
+
+def _scan_files(directory: Path) -> Iterator[Path]:
+    unprocessed = [directory]
+    while unprocessed:
+        try:
+            with os.scandir(unprocessed.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        unprocessed.append(entry.path)
+                    elif entry.is_file():
+                        yield Path(entry.path)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+
+def _walk(graph: dict[Path, set[Path]], file_path: Path) -> set[Path]:
+    found = {file_path}
+    unprocessed = [file_path]
+    while unprocessed:
+        for node in graph.get(unprocessed.pop(), ()):
+            if node not in found:
+                found.add(node)
+                unprocessed.append(node)
+    return found
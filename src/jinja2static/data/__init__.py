@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import hashlib
 import importlib
 import inspect
+import json
 import logging
 import os
+import pickle
 import sys
 import traceback
+from collections import ChainMap
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from pathlib import Path
@@ -13,6 +17,16 @@ from typing import TYPE_CHECKING
 
 import yaml
 
+from ..generate import PageGenerator
+from ..output import file_hash
+from ..profiler import span
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11
+    import tomli as tomllib
+
 if TYPE_CHECKING:
     from pathlib import Path
 
@@ -20,12 +34,86 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# The C loader is only available when PyYAML was built against libyaml.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def parse_yaml(stream):
+    return yaml.load(stream, Loader=YAML_LOADER)
+
+
+# Data file formats, in the order they are looked for.
+DATA_FILE_PARSERS = {
+    ".yaml": parse_yaml,
+    ".yml": parse_yaml,
+    ".json": json.load,
+    ".toml": tomllib.load,
+}
+
+# JSON parses about as fast as a snapshot loads.
+SNAPSHOT_SUFFIXES = {".yaml", ".yml", ".toml"}
+
+DATA_FILE_SUFFIXES = {".py", *DATA_FILE_PARSERS}
+
+
+def load_data_file(
+    file_path: Path, snapshots: Path | None = None, digest: str | None = None
+):
+    """
+    Parses a data file. Parsed YAML and TOML files are snapshotted in the
+    'snapshots' directory, keyed by the file's content hash ('digest', when
+    already known), so unchanged files are unpickled rather than parsed again.
+    """
+    parse = DATA_FILE_PARSERS[file_path.suffix]
+    if snapshots is None or file_path.suffix not in SNAPSHOT_SUFFIXES:
+        with open(file_path, "rb") as stream:
+            return parse(stream)
+    path_key = hashlib.sha256(str(file_path).encode("utf-8")).hexdigest()[:16]
+    snapshot_path = snapshots / f"{path_key}-{digest or file_hash(file_path)}.pickle"
+    try:
+        with open(snapshot_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.debug(f"Unable to read data snapshot '{snapshot_path}': {e}")
+    with open(file_path, "rb") as stream:
+        data = parse(stream)
+    try:
+        snapshots.mkdir(parents=True, exist_ok=True)
+        for stale_snapshot_path in snapshots.glob(f"{path_key}-*.pickle"):
+            stale_snapshot_path.unlink(missing_ok=True)
+        tmp_file_path = snapshot_path.with_name(f".{snapshot_path.name}.tmp")
+        with open(tmp_file_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file_path, snapshot_path)
+    except (OSError, pickle.PicklingError) as e:
+        logger.debug(f"Unable to save data snapshot '{snapshot_path}': {e}")
+    return data
+
 
 class JinjaDataFunction(Enum):
     """An enumeration of colors."""
 
     GLOBAL = auto()
     PER_PAGE = auto()
+    GENERATE_PAGES = auto()
+
+
+def changed_keys(previous: dict, current: dict) -> set[str]:
+    changed = set()
+    for key in previous.keys() | current.keys():
+        try:
+            if (
+                key not in previous
+                or key not in current
+                or previous[key] != current[key]
+            ):
+                changed.add(key)
+        except Exception:
+            # Values that can't be compared are assumed to have changed.
+            changed.add(key)
+    return changed
 
 
 def global_data(func):
@@ -38,6 +126,29 @@ def per_page_data(func):
     return func
 
 
+def generate_pages(template: str, url: str, per_page: int | None = None):
+    """
+    Marks a function returning an iterable of items, which renders 'template'
+    once per item, or once per 'per_page' items, into the output 'url'.
+    """
+
+    def decorator(func):
+        func.jinja2static = JinjaDataFunction.GENERATE_PAGES
+        func.jinja2static_pages = {
+            "template": template,
+            "url": url,
+            "per_page": per_page,
+        }
+        return func
+
+    return decorator
+
+
+def function_name(func) -> str:
+    # Data modules are named after their file path.
+    return f"{func.__module__}.{func.__qualname__}".lstrip(".")
+
+
 def load_pymod(file_path: Path):
     suffix = ".__init__.py" if file_path.name == "__init__.py" else ".py"
     module_name = str(file_path).replace("/", ".").removesuffix(suffix)
@@ -56,7 +167,7 @@ def load_pymod(file_path: Path):
 
 
 def get_callback_functions(data_module: DataModule):
-    data_functions = {JinjaDataFunction.GLOBAL: [], JinjaDataFunction.PER_PAGE: []}
+    data_functions = {func_type: [] for func_type in JinjaDataFunction}
     file_path = data_module.pymod_file_path
     if not file_path:
         return data_functions
@@ -77,9 +188,9 @@ class DataModule:
     config: Config = field()
     file_path: Path = field()
 
-    submodules = []
-
     def __post_init__(self):
+        self.submodules: list[DataModule] = []
+        self._modules_for: dict[Path, tuple[DataModule, ...]] = {}
         if not self.pymod_file_path or self.file_path.is_file():
             return
         logger.debug(f"Getting subpaths for {self.file_path}")
@@ -88,7 +199,7 @@ class DataModule:
             for file_path in self.file_path.iterdir()
             if file_path.suffix == ".py"
             and file_path != self.pymod_file_path
-            and file_path != self.yaml_file_path
+            and file_path != self.data_file_path
             and file_path.name != "__pycache__"  # TODO: make this more robust
         ]
         logger.debug(f"Recursing through {[path.name for path in subpaths]}")
@@ -97,55 +208,70 @@ class DataModule:
             for file_path in subpaths
         ]
 
-    _functions = {}
+    # Loaded lazily, 'None' until then.
+    _functions = None
 
     @property
     def functions(self):
-        if not self._functions:
+        if self._functions is None:
             self.update_functions()
         return self._functions
 
     def update_functions(self):
         self._functions = get_callback_functions(self)
 
-    _yaml_data = {}
+    _file_data = None
+    _file_digest = None
 
     @property
-    def yaml_data(self):
-        if not self._yaml_data:
-            self.update_yaml_data()
-        return self._yaml_data
-
-    def update_yaml_data(self) -> bool:
-        if not self.yaml_file_path:
+    def file_data(self):
+        if self._file_data is None:
+            self.update_file_data()
+        return self._file_data
+
+    def update_file_data(self) -> bool:
+        if self._file_data is None:
+            self._file_data = {}
+        if not self.data_file_path:
             return False
-        logger.debug(f"Getting yaml data from '{self.yaml_file_path}'")
-        with open(self.yaml_file_path, "r") as stream:
-            try:
-                self._yaml_data = yaml.safe_load(stream)
-                return True
-            except yaml.YAMLError as exc:
-                logger.error(f"YAML file {self.yaml_file_path}'")
-                logger.info(exc)
-                return False
+        logger.debug(f"Getting data from '{self.data_file_path}'")
+        digest = file_hash(self.data_file_path)
+        try:
+            with span("data_file", str(self.data_file_path)):
+                file_data = load_data_file(
+                    self.data_file_path, self.config.cache / "data", digest
+                )
+        except (yaml.YAMLError, ValueError) as exc:
+            logger.error(f"Unable to parse data file '{self.data_file_path}'")
+            logger.info(exc)
+            return False
+        if file_data is not None and not isinstance(file_data, dict):
+            logger.error(f"Data file '{self.data_file_path}' is not a mapping")
+            return False
+        self._file_data = file_data or {}
+        self._file_digest = digest
+        return True
 
-    _global_data = {}
+    _global_data = None
 
     @property
     def global_data(self):
-        if not self._global_data:
+        if self._global_data is None:
             self.update_pymod_data()
         return self._global_data
 
+    _pymod_digest = None
+
     def update_pymod_data(self):
         self.update_functions()
+        self._pymod_digest = (
+            file_hash(self.pymod_file_path) if self.pymod_file_path else None
+        )
         self._global_data = {}
         for f in self.functions[JinjaDataFunction.GLOBAL]:
             try:
-                self._global_data = {
-                    **self._global_data,
-                    **f(self._global_data, self.config),
-                }
+                with span("data_function", function_name(f)):
+                    self._global_data.update(f(self._global_data, self.config))
             except Exception as e:
                 logger.error(f"{e}")
                 logger.info(traceback.format_exc())
@@ -154,10 +280,8 @@ class DataModule:
         per_file_data = {}
         for f in self.functions[JinjaDataFunction.PER_PAGE]:
             try:
-                per_file_data = {
-                    **per_file_data,
-                    **f(per_file_data, self.config, file_path),
-                }
+                with span("data_function", function_name(f)):
+                    per_file_data.update(f(per_file_data, self.config, file_path))
             except Exception as e:
                 logger.error(f"{e}")
                 logger.info(traceback.format_exc())
@@ -176,15 +300,13 @@ class DataModule:
         return None
 
     @property
-    def yaml_file_path(self):
+    def data_file_path(self):
         file_path = self.file_path
-        possible_yamls = [
-            file_path.with_suffix(".yaml"),
-            file_path.with_suffix(".yml"),
-            file_path / "__init__.yaml",
-            file_path / "__init__.yml",
+        possible_data_files = [
+            *(file_path.with_suffix(suffix) for suffix in DATA_FILE_PARSERS),
+            *(file_path / f"__init__{suffix}" for suffix in DATA_FILE_PARSERS),
         ]
-        for file_path in possible_yamls:
+        for file_path in possible_data_files:
             if file_path.exists():
                 return file_path
         return None
@@ -192,37 +314,57 @@ class DataModule:
     def is_data_file_path(self, file_path: Path):
         if self.pymod_file_path == file_path:
             return True
-        if self.yaml_file_path == file_path:
+        if self.data_file_path == file_path:
             return True
         return False
 
     def __contains__(self, file_path: Path):
-        return self.is_data_file_path(file_path) or file_path.is_relative_to(
-            self.config.data
+        return (
+            self.is_data_file_path(file_path)
+            or file_path.is_relative_to(self.config.data)
+            or self.module_for(file_path) is not None
         )
 
     def get_update_function_for(self, file_path: Path):
-        logger.debug(f"file: '{file_path}', yaml: '{self.yaml_file_path}'")
+        logger.debug(f"file: '{file_path}', data file: '{self.data_file_path}'")
         if self.pymod_file_path == file_path:
             return self.update_pymod_data
-        if self.yaml_file_path == file_path:
-            return self.update_yaml_data
+        if self.data_file_path == file_path:
+            return self.update_file_data
         logger.warning(
             f"Data file '{file_path}' not registred as a valid data file for '{self.file_path}'."
         )
         logger.warning(
-            f"pymod file: {self.pymod_file_path}, yaml: {self.yaml_file_path}"
+            f"pymod file: {self.pymod_file_path}, data file: {self.data_file_path}"
         )
         return False
 
     def get_data_mod_for(self, file_path: Path):
         if self.is_data_file_path(file_path):
             return self
-        return (
-            next(submod.get_data_mod_for(file_path) for submod in self.submodules)
-            if self.submodules
-            else None
-        )
+        for submod in self.submodules:
+            data_mod = submod.get_data_mod_for(file_path)
+            if data_mod:
+                return data_mod
+        return None
+
+    def module_for(self, file_path: Path):
+        """
+        Get the module a data file belongs to by its path alone, so it also
+        works for data files that have been deleted.
+        """
+        if file_path.suffix not in DATA_FILE_SUFFIXES:
+            return None
+        module_path = (
+            file_path.parent if file_path.stem == "__init__" else file_path
+        ).with_suffix("")
+        if self.file_path.with_suffix("") == module_path:
+            return self
+        for submod in self.submodules:
+            data_mod = submod.module_for(file_path)
+            if data_mod:
+                return data_mod
+        return None
 
     def effects_template_file(self, file_path: Path) -> bool:
         data_file_path = (
@@ -233,30 +375,100 @@ class DataModule:
             *data_file_path.parents,
         ]
 
-    def update(self, file_path: Path) -> list[Path]:
+    def update(self, file_path: Path) -> set[str] | None:
+        """
+        Reloads the data file 'file_path' and returns the top level keys whose
+        values changed. Returns None when every page the file applies to
+        should be rebuilt instead: when it had not been loaded yet, was saved
+        without changes (e.g. touched to force a rebuild) or is a module
+        providing per page data.
+        """
         if not file_path in self:
-            return
+            return None
+        self._modules_for.clear()
         data_mod = self.get_data_mod_for(file_path)
+        if not data_mod:
+            return None
         update_fn = data_mod.get_update_function_for(file_path)
-        if update_fn:
-            return update_fn()
-        return [
-            page for page in self.config.pages if data_mod.effects_template_file(page)
-        ]
+        if update_fn == data_mod.update_file_data:
+            previous, previous_digest = data_mod._file_data, data_mod._file_digest
+            update_fn()
+            current, digest = data_mod._file_data, data_mod._file_digest
+        elif update_fn == data_mod.update_pymod_data:
+            if data_mod._functions and data_mod._functions[JinjaDataFunction.PER_PAGE]:
+                update_fn()
+                return None
+            previous, previous_digest = data_mod._global_data, data_mod._pymod_digest
+            update_fn()
+            current, digest = data_mod._global_data, data_mod._pymod_digest
+            if data_mod.functions[JinjaDataFunction.PER_PAGE]:
+                return None
+        else:
+            return None
+        if previous is None or digest == previous_digest:
+            return None
+        return changed_keys(previous, current)
 
     def effected_pages(self, file_path: Path):
         if not file_path in self:
             return []
-        data_mod = self.get_data_mod_for(file_path)
+        data_mod = self.get_data_mod_for(file_path) or self.module_for(file_path)
+        if not data_mod:
+            return []
         return [
             page for page in self.config.pages if data_mod.effects_template_file(page)
         ]
 
-    def data_for(self, file_path: Path):
-        """Get data for a specific template file path"""
-        if not self.effects_template_file(file_path):
-            return {}
-        data = {**self.yaml_data, **self.global_data, **self.per_file_data(file_path)}
+    def page_generators(self) -> list[PageGenerator]:
+        """Get the page generators of this module and its submodules."""
+        generators = [
+            PageGenerator.from_function(self.config, function)
+            for function in self.functions[JinjaDataFunction.GENERATE_PAGES]
+        ]
         for submod in self.submodules:
-            data = {**data, **submod.data_for(file_path)}
-        return data
+            generators.extend(submod.page_generators())
+        return generators
+
+    def modules_for(self, file_path: Path) -> tuple[DataModule, ...]:
+        """
+        Get the modules that provide data for a template file path, outermost
+        first. Cached per template until the next 'update'.
+        """
+        modules = self._modules_for.get(file_path)
+        if modules is None:
+            modules = ()
+            if self.effects_template_file(file_path):
+                modules = (self,) + tuple(
+                    data_mod
+                    for submod in self.submodules
+                    for data_mod in submod.modules_for(file_path)
+                )
+            self._modules_for[file_path] = modules
+        return modules
+
+    def data_files_for(self, file_path: Path) -> list[Path]:
+        """Get the data files that provide data for a specific template file path"""
+        return [
+            data_file
+            for data_mod in self.modules_for(file_path)
+            for data_file in [data_mod.data_file_path, data_mod.pymod_file_path]
+            if data_file
+        ]
+
+    def data_for(self, file_path: Path) -> ChainMap:
+        """
+        Get data for a specific template file path. Inner modules' data takes
+        precedence, and within a module per page data takes precedence over
+        global data, which takes precedence over data file contents. The layers are
+        chained rather than copied.
+        """
+        layers = []
+        for data_mod in reversed(self.modules_for(file_path)):
+            layers.extend(
+                [
+                    data_mod.per_file_data(file_path),
+                    data_mod.global_data,
+                    data_mod.file_data,
+                ]
+            )
+        return ChainMap(*layers)
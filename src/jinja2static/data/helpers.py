@@ -2,63 +2,205 @@
 File for helper functions that can be used to inject dynamic data
 """
 
+from __future__ import annotations
+
 import logging
 import subprocess
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+_git_toplevels: dict[Path, Path | None] = {}
+_git_histories: dict[Path, GitHistory] = {}
+
 
 def get_git_toplevel_for(file_path):
-    logger.debug(f"Getting git repo for '{file_path}'")
-    cmd = ["git", "rev-parse", "--show-toplevel", str(file_path)]
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    """
+    Finds the root of the git repository containing 'file_path', looking for
+    a '.git' entry in its parent directories first. Cached per directory.
+    """
+    file_path = Path(file_path).absolute()
+    dir_path = file_path if file_path.is_dir() else file_path.parent
+    if dir_path in _git_toplevels:
+        return _git_toplevels[dir_path]
+    toplevel = next(
+        (path for path in [dir_path, *dir_path.parents] if (path / ".git").exists()),
+        None,
     )
-    stdout, stderr = process.communicate()
-    if stderr:
-        logger.debug(f"Error getting creation date for {file_path}: {stderr}")
-        return None
-    return Path(stdout.strip().split("\n")[0])
+    if not toplevel:
+        logger.debug(f"Getting git repo for '{file_path}'")
+        cmd = ["git", "-C", str(dir_path), "rev-parse", "--show-toplevel"]
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        stdout, stderr = process.communicate()
+        if stderr or not stdout.strip():
+            logger.debug(f"Error getting git repo for {file_path}: {stderr}")
+        else:
+            toplevel = Path(stdout.strip().split("\n")[0])
+    _git_toplevels[dir_path] = toplevel
+    return toplevel
 
 
-def get_git_logs(file_path, filter_flag: str) -> datetime:
+def read_git_head(toplevel: Path) -> str | None:
     """
-    Retrieves the first and last commit date for a given file from git history.
-    These can be thought of as the creation and last updated dates for the file.
+    Reads the commit HEAD points to straight from the '.git' directory,
+    falling back to 'git rev-parse' for layouts it does not understand.
     """
-    logger.debug(f"Getting git commits for '{file_path}'")
-    cmd = [
-        "git",
-        "-C",
-        str(file_path.parent),
-        "--no-pager",
-        "log",
-        filter_flag,
-        "--pretty=format:%cI",
-        "--follow",
-        "--",
-        str(file_path.name),
-    ]
+    try:
+        git_dir = toplevel / ".git"
+        if git_dir.is_file():
+            # Worktrees and submodules point to their git directory.
+            git_dir = toplevel / git_dir.read_text().removeprefix("gitdir:").strip()
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head.removeprefix("ref:").strip()
+        ref_file_path = git_dir / ref
+        if ref_file_path.is_file():
+            return ref_file_path.read_text().strip()
+        with open(git_dir / "packed-refs", "r") as f:
+            for line in f:
+                if line.rstrip().endswith(f" {ref}"):
+                    return line.split(" ", 1)[0]
+    except OSError:
+        pass
+    cmd = ["git", "-C", str(toplevel), "rev-parse", "HEAD"]
     process = subprocess.Popen(
         cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
     )
     stdout, stderr = process.communicate()
-    if stderr:
-        logger.debug(f"Error getting creation date for {file_path}: {stderr}")
+    if process.returncode:
+        logger.debug(f"Error getting HEAD of '{toplevel}': {stderr}")
         return None
-    date_str = stdout.strip().split("\n")[-1]
-    try:
-        return datetime.fromisoformat(date_str)
-    except ValueError as e:
-        logger.debug(f"Error parsing date '{date_str}': {e}")
+    return stdout.strip()
+
+
+@dataclass
+class GitHistory:
+    """
+    First and last commit dates of every file in a repository, read from a
+    single pass over its history. Renames are followed, so files keep the
+    creation date of the path they were renamed from.
+    """
+
+    toplevel: Path = field()
+    head: str | None = field()
+    created: dict[str, datetime] = field(default_factory=dict)
+    updated: dict[str, datetime] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, toplevel: Path, head: str | None) -> GitHistory:
+        history = cls(toplevel=toplevel, head=head)
+        if not head:
+            return history
+        logger.debug(f"Reading git history of '{toplevel}'")
+        cmd = [
+            "git",
+            "-C",
+            str(toplevel),
+            "--no-pager",
+            "log",
+            "-z",
+            "-M",
+            "--name-status",
+            "--pretty=format:%x01%cI",
+        ]
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        stdout, stderr = process.communicate()
+        if process.returncode:
+            logger.debug(f"Error reading git history of '{toplevel}': {stderr}")
+            return history
+        history.index(stdout)
+        return history
+
+    def index(self, log: str):
+        """
+        Indexes 'git log -z --name-status' output, which lists the newest
+        commits first. 'renamed' maps the older names of files to their
+        current ones.
+        """
+        renamed: dict[str, str] = {}
+        for commit in log.split("\x01"):
+            date_str, _, changes = commit.partition("\n")
+            if not date_str.strip():
+                continue
+            try:
+                date = datetime.fromisoformat(date_str.strip())
+            except ValueError as e:
+                logger.debug(f"Error parsing date '{date_str}': {e}")
+                continue
+            fields = changes.split("\x00")
+            i = 0
+            while i < len(fields):
+                status = fields[i]
+                if not status:
+                    i += 1
+                    continue
+                if status[0] in "RC":
+                    old_path, path = fields[i + 1 : i + 3]
+                    i += 3
+                else:
+                    old_path, path = None, fields[i + 1]
+                    i += 2
+                path = renamed.get(path, path)
+                self.updated.setdefault(path, date)
+                if status[0] in "AC":
+                    # Older additions overwrite newer ones.
+                    self.created[path] = date
+                elif status[0] == "R":
+                    renamed[old_path] = path
+
+    def relative_path_for(self, file_path: Path) -> Path | None:
+        try:
+            return Path(file_path).resolve().relative_to(self.toplevel.resolve())
+        except ValueError:
+            return None
+
+
+def get_git_history(file_path) -> GitHistory | None:
+    """
+    Gets the history of the repository containing 'file_path', re-reading
+    it only once the repository's HEAD moves.
+    """
+    toplevel = get_git_toplevel_for(file_path)
+    if not toplevel:
         return None
+    head = read_git_head(toplevel)
+    history = _git_histories.get(toplevel)
+    if not history or history.head != head:
+        history = _git_histories[toplevel] = GitHistory.load(toplevel, head)
+    return history
 
 
 def get_creation_datetime(file_path):
-    return get_git_logs(file_path, "--diff-filter=A")
+    history = get_git_history(file_path)
+    if not history:
+        return None
+    file_path = history.relative_path_for(file_path)
+    return history.created.get(file_path.as_posix()) if file_path else None
 
 
 def get_last_updated_datetime(file_path):
-    return get_git_logs(file_path, "-1")
+    history = get_git_history(file_path)
+    if not history:
+        return None
+    file_path = history.relative_path_for(file_path)
+    return history.updated.get(file_path.as_posix()) if file_path else None
+
+
+def get_git_logs(file_path, filter_flag: str) -> datetime | None:
+    """
+    Gets the date 'git log' with 'filter_flag' would report for 'file_path':
+    the creation date for '--diff-filter=A' and the last updated date for
+    '-1'. Reads the same cached history as the helpers above.
+    """
+    if filter_flag == "--diff-filter=A":
+        return get_creation_datetime(file_path)
+    if filter_flag == "-1":
+        return get_last_updated_datetime(file_path)
+    raise ValueError(f"Unsupported git log filter '{filter_flag}'")
@@ -0,0 +1,275 @@
+"""
+Pages generated from data: a data module function decorated with
+'@generate_pages' yields items, and a template is rendered once per item (or
+per chunk of items) into outputs named after them.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from collections import ChainMap, deque
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from itertools import chain, islice
+from pathlib import Path
+from string import Formatter
+from typing import TYPE_CHECKING
+
+from .profiler import profiled_page, span
+from .templates import (
+    PARALLEL_MIN_PAGES,
+    collect_worker_events,
+    render_template,
+    worker_config,
+    worker_events,
+    worker_pool,
+)
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Pages sent to a worker at a time.
+GENERATE_BATCH_SIZE = 16
+
+
+@dataclass
+class Pagination:
+    """Where a chunk of items sits among the pages of a paginated generator."""
+
+    number: int = field()
+    per_page: int = field()
+    url: str = field()
+    previous_url: str | None = field(default=None)
+    next_url: str | None = field(default=None)
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_url is not None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_url is not None
+
+
+@dataclass
+class PageGenerator:
+    name: str = field()
+    function: Callable = field()
+    template: Path = field()
+    url: str = field()
+    per_page: int | None = field(default=None)
+
+    @classmethod
+    def from_function(cls, config: Config, function: Callable) -> PageGenerator:
+        settings = function.jinja2static_pages
+        return cls(
+            name=f"{function.__module__}.{function.__name__}",
+            function=function,
+            template=config.templates / settings["template"],
+            url=settings["url"],
+            per_page=settings["per_page"],
+        )
+
+    def url_fields(self) -> set[str]:
+        """The names the url pattern formats, e.g. 'slug' for '{slug}.html'."""
+        return {
+            name.partition(".")[0].partition("[")[0]
+            for _, name, _, _ in Formatter().parse(self.url)
+            if name
+        }
+
+    def url_for(self, **values) -> str:
+        item = values.get("item")
+        if isinstance(item, Mapping):
+            # Fields of items are formatted directly, as long as they are not
+            # ambiguous with the values passed here ('item', 'index', 'page').
+            ambiguous = self.url_fields() & values.keys() & item.keys()
+            if ambiguous:
+                raise ValueError(
+                    f"Url '{self.url}' uses {sorted(ambiguous)}, which items "
+                    "also have as fields. Use '{item[...]}' to format them."
+                )
+            values = ChainMap(values, item)
+        return self.url.format_map(values).lstrip("/")
+
+    def pages(self, config: Config, data: Mapping) -> Iterator[tuple[str, Mapping]]:
+        """
+        Lazily yields the output path of every generated page along with the
+        data it adds to the template's 'data'. Items are pulled from the
+        function's iterable as pages are rendered, one chunk ahead when
+        paginating.
+        """
+        items = iter(self.function(data, config))
+        if not self.per_page:
+            for index, item in enumerate(items):
+                yield self.url_for(item=item, index=index), {"item": item}
+            return
+        number = 1
+        chunk = list(islice(items, self.per_page))
+        while chunk:
+            next_chunk = list(islice(items, self.per_page))
+            url = self.url_for(page=number)
+            pagination = Pagination(
+                number=number,
+                per_page=self.per_page,
+                url=f"/{url}",
+                previous_url=f"/{self.url_for(page=number - 1)}"
+                if number > 1
+                else None,
+                next_url=f"/{self.url_for(page=number + 1)}" if next_chunk else None,
+            )
+            yield url, {"items": chunk, "pagination": pagination}
+            number += 1
+            chunk = next_chunk
+
+
+def generated_pages(
+    config: Config, generator: PageGenerator, data: Mapping
+) -> Iterator[tuple[str, Mapping]]:
+    """The pages of 'generator', skipping the outputs it may not write."""
+    for output, page_data in generator.pages(config, data):
+        dst_file_path = config.dist / output
+        if not dst_file_path.resolve().is_relative_to(config.dist.resolve()):
+            logger.error(f"'{generator.name}' generated '{output}' outside of dist")
+            continue
+        if config.templates / output in config.pages:
+            logger.error(f"'{generator.name}' generated existing page '{output}'")
+            continue
+        yield output, page_data
+
+
+def render_generated_pages(
+    config: Config,
+    generator: PageGenerator,
+    pages: Iterable[tuple[str, Mapping]],
+    data: Mapping,
+    cancelled: Callable[[], bool] | None = None,
+) -> dict[str, bool]:
+    """Renders 'pages' of 'generator' and returns whether each one succeeded."""
+    cancelled = cancelled or (lambda: False)
+    template_name = generator.template.relative_to(config.templates).as_posix()
+    results = {}
+    try:
+        for output, page_data in pages:
+            if cancelled():
+                break
+            with profiled_page(output):
+                results[output] = render_template(
+                    config,
+                    template_name,
+                    config.dist / output,
+                    ChainMap(page_data, data),
+                )
+    except Exception as e:
+        logger.error(f"Unable to generate pages with '{generator.name}': {e}")
+    return results
+
+
+def _render_generated_pages_in_worker(
+    name: str, pages: list[tuple[str, Mapping]]
+) -> tuple[dict[str, bool], list]:
+    config = worker_config()
+    generator = next(
+        generator
+        for generator in config.data_module.page_generators()
+        if generator.name == name
+    )
+    with span("data", generator.name):
+        data = config.data_for(generator.template)
+    results = render_generated_pages(config, generator, pages, data)
+    return results, worker_events()
+
+
+def render_generated_pages_in_workers(
+    config: Config,
+    executor: ProcessPoolExecutor,
+    generator: PageGenerator,
+    pages: Iterator[tuple[str, Mapping]],
+    data: Mapping,
+    jobs: int,
+    cancelled: Callable[[], bool] | None = None,
+) -> dict[str, bool]:
+    """
+    Sends 'pages' to the workers in batches, pulling them from the generator
+    only as the workers keep up, so items are iterated once and only a few
+    batches are held in memory.
+    """
+    cancelled = cancelled or (lambda: False)
+    results = {}
+    pending = deque()
+
+    def collect():
+        batch, future = pending.popleft()
+        try:
+            batch_results, events = future.result()
+        except Exception as e:
+            # Most likely items that can't be sent to another process.
+            logger.debug(f"Rendering pages of '{generator.name}' in-process: {e}")
+            batch_results = render_generated_pages(config, generator, batch, data)
+            events = []
+        results.update(batch_results)
+        collect_worker_events(events)
+
+    try:
+        while not cancelled() and (batch := list(islice(pages, GENERATE_BATCH_SIZE))):
+            future = executor.submit(
+                _render_generated_pages_in_worker, generator.name, batch
+            )
+            pending.append((batch, future))
+            if len(pending) >= 2 * jobs:
+                collect()
+    except Exception as e:
+        logger.error(f"Unable to generate pages with '{generator.name}': {e}")
+    while pending:
+        collect()
+    return results
+
+
+def build_generated_pages(
+    config: Config,
+    jobs: int | None = None,
+    cancelled: Callable[[], bool] | None = None,
+) -> dict[str, bool]:
+    """
+    Renders the pages of every generator in the project. Each generator's
+    items are iterated once, here, and generators with enough pages have
+    them rendered by worker processes.
+    """
+    generators = config.data_module.page_generators()
+    if not generators:
+        return {}
+    logger.info(f"Generating pages with {[g.name for g in generators]}...")
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+    with ExitStack() as stack:
+        executor = None
+        for generator in generators:
+            with span("data", generator.name):
+                data = config.data_for(generator.template)
+            pages = generated_pages(config, generator, data)
+            try:
+                first_pages = list(islice(pages, PARALLEL_MIN_PAGES))
+            except Exception as e:
+                logger.error(f"Unable to generate pages with '{generator.name}': {e}")
+                continue
+            pages = chain(first_pages, pages)
+            if jobs <= 1 or len(first_pages) < PARALLEL_MIN_PAGES:
+                results |= render_generated_pages(
+                    config, generator, pages, data, cancelled
+                )
+                continue
+            if executor is None:
+                executor = stack.enter_context(worker_pool(config, jobs))
+            results |= render_generated_pages_in_workers(
+                config, executor, generator, pages, data, jobs, cancelled
+            )
+    failed = list(results.values()).count(False)
+    if failed:
+        logger.error(f"{failed} of {len(results)} generated pages failed to build.")
+    return results
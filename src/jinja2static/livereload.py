@@ -0,0 +1,122 @@
+"""
+Tells browsers viewing the development server to reload when the watcher
+rebuilds the page they are on, or to swap stylesheets when only CSS changed.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from asyncio import AbstractEventLoop, Queue, get_running_loop
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = "/__jinja2static__/events"
+WORKER_PATH = "/__jinja2static__/livereload.js"
+
+# Browsers allow around six connections per host, so tabs share a single event
+# stream through a SharedWorker where they can, instead of opening one each.
+# The scripts spell out EVENTS_PATH and WORKER_PATH.
+WORKER_SCRIPT = b"""const ports = new Set();
+const source = new EventSource("/__jinja2static__/events");
+source.addEventListener("change", (event) => {
+  const change = JSON.parse(event.data);
+  for (const port of ports) port.postMessage(change);
+});
+onconnect = (event) => {
+  const port = event.ports[0];
+  ports.add(port);
+  port.onmessage = () => ports.delete(port);
+};
+"""
+
+CLIENT_SCRIPT = b"""<script>
+(() => {
+  const page = location.pathname.endsWith("/")
+    ? location.pathname + "index.html"
+    : location.pathname;
+  const onChange = (change) => {
+    if (change.reload || change.pages.includes(page)) return location.reload();
+    for (const link of document.querySelectorAll('link[rel="stylesheet"]')) {
+      const url = new URL(link.href);
+      if (url.origin !== location.origin) continue;
+      if (!change.stylesheets.includes(url.pathname)) continue;
+      url.searchParams.set("jinja2static", Date.now());
+      link.href = url.href;
+    }
+  };
+  if (window.SharedWorker) {
+    const worker = new SharedWorker("/__jinja2static__/livereload.js");
+    worker.port.onmessage = (event) => onChange(event.data);
+    addEventListener("pagehide", () => worker.port.postMessage("close"));
+  } else {
+    const source = new EventSource("/__jinja2static__/events");
+    source.addEventListener("change", (event) => onChange(JSON.parse(event.data)));
+  }
+})();
+</script>
+"""
+
+
+@dataclass(eq=False)
+class LiveReloadClient:
+    events: Queue = field(default_factory=Queue)
+
+
+class LiveReload:
+    def __init__(self, config: Config):
+        self.config = config
+        self.clients: set[LiveReloadClient] = set()
+        self.loop: AbstractEventLoop | None = None
+        config.on_outputs_changed(self.publish)
+
+    def subscribe(self) -> LiveReloadClient:
+        self.loop = get_running_loop()
+        client = LiveReloadClient()
+        self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client: LiveReloadClient):
+        self.clients.discard(client)
+
+    def inject(self, body: bytes) -> bytes:
+        index = body.lower().rfind(b"</body>")
+        if index < 0:
+            return body + CLIENT_SCRIPT
+        return body[:index] + CLIENT_SCRIPT + body[index:]
+
+    def publish(self, file_paths: set[Path]):
+        """
+        Tells every browser what changed. Each tab reloads if the page it is
+        on was rebuilt, or swaps changed stylesheets in place. Any other
+        changed asset reloads every tab since there is no telling which pages
+        use it.
+        """
+        urls = {
+            "/" + file_path.relative_to(self.config.dist).as_posix()
+            for file_path in file_paths
+            if file_path.is_relative_to(self.config.dist)
+        }
+        if not urls or not self.clients:
+            return
+        stylesheets = {url for url in urls if url.endswith(".css")}
+        pages = {url for url in urls if url.endswith((".html", ".htm"))}
+        change = {
+            "pages": sorted(pages),
+            "stylesheets": sorted(stylesheets),
+            "reload": bool(urls - stylesheets - pages),
+        }
+        for client in self.clients:
+            self.send(client, "change", change)
+
+    def send(self, client: LiveReloadClient, event: str, data):
+        logger.debug(f"Sending '{event}' to a browser: {data}")
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        # Rebuilds may publish from outside of the server's event loop.
+        self.loop.call_soon_threadsafe(client.events.put_nowait, message)
@@ -0,0 +1,109 @@
+"""
+On-disk record of the inputs each output of the last build was produced from,
+used to only rebuild what changed.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import jinja2
+
+from .output import file_hash
+
+if TYPE_CHECKING:
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+
+def config_settings(config: Config) -> dict[str, str]:
+    return {
+        "jinja2": jinja2.__version__,
+        **{f.name: str(getattr(config, f.name)) for f in fields(config)},
+    }
+
+
+@dataclass
+class BuildManifest:
+    config: Config = field()
+    pages: dict[str, dict[str, str | None]] = field(default_factory=dict)
+    assets: dict[str, list[int]] = field(default_factory=dict)
+    compressed: dict[str, list] = field(default_factory=dict)
+    data_access: dict[str, list[str]] = field(default_factory=dict)
+    _hashes: dict[Path, str | None] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    @classmethod
+    def file_path_for(cls, config: Config) -> Path:
+        return config.cache / "manifest.json"
+
+    @classmethod
+    def load(cls, config: Config) -> BuildManifest | None:
+        file_path = cls.file_path_for(config)
+        try:
+            with open(file_path, "r") as f:
+                manifest_data = json.load(f)
+        except FileNotFoundError:
+            logger.debug(f"No build manifest found at '{file_path}'")
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to read build manifest '{file_path}': {e}")
+            return None
+        if manifest_data.get("version") != MANIFEST_VERSION:
+            logger.debug("Build manifest version changed, ignoring it.")
+            return None
+        if manifest_data.get("settings") != config_settings(config):
+            logger.debug("Project settings changed since last build.")
+            return None
+        return cls(
+            config=config,
+            pages=manifest_data.get("pages", {}),
+            assets=manifest_data.get("assets", {}),
+            compressed=manifest_data.get("compressed", {}),
+            data_access=manifest_data.get("data_access", {}),
+        )
+
+    def save(self):
+        file_path = self.file_path_for(self.config)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_data = {
+            "version": MANIFEST_VERSION,
+            "settings": config_settings(self.config),
+            "pages": self.pages,
+            "assets": self.assets,
+            "compressed": self.compressed,
+            "data_access": self.data_access,
+        }
+        with open(file_path, "w") as f:
+            json.dump(manifest_data, f)
+        logger.debug(f"Saved build manifest to '{file_path}'")
+
+    def hash(self, file_path: Path) -> str | None:
+        if file_path not in self._hashes:
+            self._hashes[file_path] = file_hash(file_path)
+        return self._hashes[file_path]
+
+    def page_inputs(self, page: Path) -> dict[str, str | None]:
+        """
+        Hashes of every file rendering 'page' depends on: the page itself,
+        the templates it references (transitively) and its data files.
+        """
+        input_files = [
+            *sorted(self.config.get_subtemplates(page)),
+            *self.config.data_module.data_files_for(page),
+        ]
+        return {str(file_path): self.hash(file_path) for file_path in input_files}
+
+    def is_stale(self, page: Path, inputs: dict[str, str | None]) -> bool:
+        output = page.relative_to(self.config.templates).as_posix()
+        if not (self.config.dist / output).is_file():
+            return True
+        return self.pages.get(output) != inputs
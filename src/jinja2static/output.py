@@ -0,0 +1,90 @@
+"""
+Helpers for writing files into the distribution directory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+from .profiler import span
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1 << 16
+
+
+def file_hash(file_path: Path) -> str | None:
+    hasher = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as f:
+            while chunk := f.read(BUFFER_SIZE):
+                hasher.update(chunk)
+    except FileNotFoundError:
+        return None
+    return hasher.hexdigest()
+
+
+class AtomicOutput:
+    """
+    Writes UTF-8 text to a temporary file next to 'dst_file_path', hashing it
+    as it goes. On exit the temporary file is moved into place, unless the
+    existing file already has the same content, in which case the existing
+    file (and its modification time) is left untouched. Either way, readers
+    never see a partially written file.
+    """
+
+    def __init__(self, dst_file_path: Path):
+        self.dst_file_path = dst_file_path
+        self.tmp_file_path = dst_file_path.with_name(
+            f".{dst_file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        self.changed = False
+
+    def __enter__(self) -> AtomicOutput:
+        self.dst_file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.tmp_file_path, "wb", buffering=BUFFER_SIZE)
+        self.reset()
+        return self
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self.hasher.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    def reset(self):
+        """Discards everything written so far."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with span("write", self.dst_file_path.name):
+            return self.commit(exc_type)
+
+    def commit(self, exc_type) -> bool:
+        self.file.close()
+        if exc_type:
+            self.tmp_file_path.unlink(missing_ok=True)
+            return False
+        self.digest = self.hasher.hexdigest()
+        if self.is_unchanged():
+            logger.debug(f"'{self.dst_file_path}' is unchanged, skipping write")
+            self.tmp_file_path.unlink()
+            return False
+        os.replace(self.tmp_file_path, self.dst_file_path)
+        self.changed = True
+        return False
+
+    def is_unchanged(self) -> bool:
+        try:
+            if self.dst_file_path.stat().st_size != self.size:
+                return False
+        except FileNotFoundError:
+            return False
+        return file_hash(self.dst_file_path) == self.digest
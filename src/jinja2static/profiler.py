@@ -0,0 +1,210 @@
+"""
+Opt-in build profiling: timed spans for each phase of every page, data
+function and asset copy, summarized in a report and saved as a Chrome trace.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Phases of building a page, in the order they happen.
+PAGE_PHASES = ["data", "load", "render", "write"]
+
+_profiler: Profiler | None = None
+
+_current_page: ContextVar[str | None] = ContextVar("current_page", default=None)
+
+
+class Profiler:
+    """Collects spans as [category, name, page, start, duration, pid, tid]."""
+
+    def __init__(self):
+        self.events: list[list] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, category: str, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            event = [
+                category,
+                name,
+                _current_page.get(),
+                start,
+                time.perf_counter() - start,
+                os.getpid(),
+                threading.get_ident(),
+            ]
+            with self.lock:
+                self.events.append(event)
+
+    def drain(self) -> list[list]:
+        """Returns and forgets the events so far, to send them to the parent."""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def extend(self, events: list[list]):
+        with self.lock:
+            self.events.extend(events)
+
+    def page_times(self) -> dict[str, dict[str, float]]:
+        """
+        Time spent in each phase of every page. Templates compiled while
+        rendering (e.g. included ones) count as loading rather than rendering.
+        """
+        times = defaultdict(lambda: dict.fromkeys(PAGE_PHASES, 0.0))
+        loads = defaultdict(list)
+        for category, _, page, start, duration, *_ in self.events:
+            if page is None:
+                continue
+            if category in PAGE_PHASES:
+                times[page][category] += duration
+            if category == "load":
+                loads[page].append((start, start + duration))
+        for category, _, page, start, duration, *_ in self.events:
+            if category != "compile" or page is None:
+                continue
+            if not any(begin <= start <= end for begin, end in loads[page]):
+                times[page]["load"] += duration
+                times[page]["render"] -= duration
+        return dict(times)
+
+    def totals(self, category: str) -> dict[str, list]:
+        """Number of calls and total and maximum time, per span name."""
+        totals = defaultdict(lambda: [0, 0.0, 0.0])
+        for event_category, name, _, _, duration, *_ in self.events:
+            if event_category != category:
+                continue
+            total = totals[name]
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+        return dict(totals)
+
+    def report(self, config: Config, limit: int = 10) -> str:
+        lines = []
+        page_times = self.page_times()
+        slowest_pages = sorted(
+            page_times.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )
+        lines.append(f"Slowest pages ({len(page_times)} built):")
+        lines.append(
+            f"  {'total':>9} "
+            + " ".join(f"{phase:>9}" for phase in PAGE_PHASES)
+            + "  page"
+        )
+        for page, times in slowest_pages[:limit]:
+            lines.append(
+                f"  {_ms(sum(times.values()))} "
+                + " ".join(_ms(times[phase]) for phase in PAGE_PHASES)
+                + f"  {page}"
+            )
+
+        # A shared template costs the render time of every page using it.
+        compiles = self.totals("compile")
+        shared = defaultdict(lambda: [0, 0.0])
+        for page, times in page_times.items():
+            page_path = config.templates / page
+            if page_path not in config.pages:
+                continue
+            for template in config.get_subtemplates(page_path) - {page_path}:
+                name = template.relative_to(config.templates).as_posix()
+                shared[name][0] += 1
+                shared[name][1] += times["render"]
+        lines.append("Most expensive shared templates:")
+        lines.append(f"  {'compile':>9} {'pages':>6} {'renders':>9}  template")
+        for name, (pages, render_time) in sorted(
+            shared.items(), key=lambda item: item[1][1], reverse=True
+        )[:limit]:
+            compile_time = compiles.get(name, [0, 0.0])[1]
+            lines.append(f"  {_ms(compile_time)} {pages:>6} {_ms(render_time)}  {name}")
+
+        lines.append("Slowest data functions:")
+        lines.append(f"  {'total':>9} {'calls':>6} {'max':>9}  function")
+        for name, (calls, total, longest) in sorted(
+            self.totals("data_function").items(),
+            key=lambda item: item[1][1],
+            reverse=True,
+        )[:limit]:
+            lines.append(f"  {_ms(total)} {calls:>6} {_ms(longest)}  {name}")
+
+        for category, label in [("data_file", "Data files"), ("assets", "Assets")]:
+            total = sum(total for _, total, _ in self.totals(category).values())
+            lines.append(f"{label}: {_ms(total).strip()}")
+        return "\n".join(lines)
+
+    def save_trace(self, file_path: Path):
+        """Saves the events in the Chrome trace format (chrome://tracing, Perfetto)."""
+        trace_events = [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": {"page": page} if page else {},
+            }
+            for category, name, page, start, duration, pid, tid in self.events
+        ]
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, "w") as f:
+            json.dump({"traceEvents": trace_events}, f)
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:>7.1f}ms"
+
+
+def enable_profiling() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    _profiler = None
+
+
+def active_profiler() -> Profiler | None:
+    return _profiler
+
+
+def span(category: str, name: str):
+    """Times the block when profiling, and does nothing otherwise."""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.span(category, name)
+
+
+@contextmanager
+def profiled_page(page: str) -> Iterator[None]:
+    """Attributes the spans in the block to the output 'page'."""
+    if _profiler is None:
+        yield
+        return
+    token = _current_page.set(page)
+    try:
+        yield
+    finally:
+        _current_page.reset(token)
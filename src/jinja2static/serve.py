@@ -1,101 +1,502 @@
+from __future__ import annotations
+
 import logging
 import mimetypes
+import os
 import traceback
-from asyncio import StreamReader, StreamWriter, start_server
+from asyncio import (
+    IncompleteReadError,
+    StreamReader,
+    StreamWriter,
+    TimeoutError,
+    get_running_loop,
+    start_server,
+    wait_for,
+)
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
 from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import unquote, urlsplit
 
+from .compress import ENCODERS, is_compressible, variant_path
 from .config import Config
+from .livereload import EVENTS_PATH, WORKER_PATH, WORKER_SCRIPT, LiveReload
 
 logger = logging.getLogger(__name__)
 
+KEEP_ALIVE_TIMEOUT = 15
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, *args, headers: dict | None = None):
+        super().__init__(*args)
+        self.status = status
+        self.headers = headers or {}
+
+
+@dataclass
+class Request:
+    method: str = field()
+    uri: str = field()
+    version: str = field()
+    headers: dict[str, str] = field(default_factory=dict)
 
-async def receive_http_get_request(reader: StreamReader):
-    request_data = b""
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def receive_http_request(reader: StreamReader) -> Request | None:
+    request_line = await reader.readline()
+    if not request_line:
+        # Client closed the connection between requests
+        return None
+    headers = {}
     while True:
         line = await reader.readline()
-        if not line:
-            # EOF reached without completing headers
-            break
-        request_data += line
-        if line == b"\r\n":
+        if not line or line == b"\r\n":
             # Found the end of headers
             break
-    headers = request_data.decode().split("\r\n")
-    method, uri, _ = headers.pop(0).split(" ")
-    return method, uri
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        method, uri, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+    try:
+        content_length = int(headers.get("content-length", 0))
+    except ValueError:
+        content_length = -1
+    if content_length < 0:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length header.")
+    # Discard any request body so the next pipelined request can be read.
+    if content_length:
+        await reader.readexactly(content_length)
+    return Request(method=method, uri=uri, version=version, headers=headers)
 
 
-def read_file(config: Config, file_path: Path) -> tuple[bytes, str]:
-    assert file_path.is_relative_to(config.dist.resolve()), (
-        f"File '{file_path}' is not located in distribution directory '{config.dist}'"
-    )
-    logger.debug(f"reading file {file_path}")
+def resolve_file_path(config: Config, uri: str) -> Path:
+    uri = unquote(urlsplit(uri).path).removeprefix("/")
+    dist = config.dist.resolve()
+    file_path = (dist / uri).resolve()
+    if not file_path.is_relative_to(dist):
+        raise HTTPError(
+            HTTPStatus.FORBIDDEN,
+            f"File '{file_path}' is not located in distribution directory '{config.dist}'",
+        )
+    if file_path.is_dir():
+        file_path = file_path / "index.html"
+    return file_path
+
+
+def content_type_for(file_path: Path) -> str:
     mime_type, _ = mimetypes.guess_type(file_path.name)
-    with open(file_path, "rb" if mime_type == "font/woff2" else "r") as file:
-        file_data = file.read()
-    file_data = file_data.encode("utf-8") if mime_type != "font/woff2" else file_data
-    return file_data, mime_type
+    if not mime_type:
+        return "application/octet-stream"
+    if mime_type.startswith("text/") or mime_type in (
+        "application/javascript",
+        "application/json",
+    ):
+        return f"{mime_type}; charset=utf-8"
+    return mime_type
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if if_none_match := request.headers.get("if-none-match"):
+        etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in etags or etag in etags
+    if if_modified_since := request.headers.get("if-modified-since"):
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def requested_range(
+    request: Request, size: int, etag: str, last_modified: str
+) -> tuple[int, int] | None:
+    """
+    Parses a single 'bytes' range into an (offset, count) tuple. Anything
+    else is ignored, in which case the whole file is sent.
+    """
+    range_header = request.headers.get("range", "")
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        return None
+    start, _, end = range_header.removeprefix("bytes=").strip().partition("-")
+    try:
+        if not start:
+            count = min(int(end), size)
+            return size - count, count
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPError(
+            HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+            f"Range '{range_header}' is not satisfiable.",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end - start + 1
+
+
+def write_http_head(
+    writer: StreamWriter,
+    status: int = 200,
+    headers: dict | None = None,
+):
+    status = HTTPStatus(status)
+    response_header = "".join(
+        [
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n",
+            *(f"{name}: {value}\r\n" for name, value in (headers or {}).items()),
+            "\r\n",
+        ]
+    )
+    writer.write(response_header.encode("latin-1"))
 
 
 async def send_http_response(
     writer: StreamWriter,
     response_body: bytes,
     status: int = 200,
-    content_type: str = "text/plain",
+    content_type: str = "text/plain; charset=utf-8",
+    headers: dict | None = None,
 ):
-    response_header = (
-        f"HTTP/1.1 {status} OK\r\n"
-        f"Content-Type: {content_type}\r\n"
-        f"Content-Length: {len(response_body)}\r\n"
-        f"\r\n"
+    write_http_head(
+        writer,
+        status,
+        {
+            "Content-Type": content_type,
+            "Content-Length": len(response_body),
+            **(headers or {}),
+        },
     )
-    writer.write(response_header.encode("utf-8"))
     writer.write(response_body)
     await writer.drain()
 
 
-def configure_requestor(config: Config):
-    async def handle_request(reader: StreamReader, writer: StreamWriter):
+@dataclass
+class FileResponse:
+    file_path: Path = field()
+    size: int = field()
+    mtime: float = field()
+    headers: dict[str, str] = field()
+    # The file's size and modification time when the response was described.
+    file_stat: tuple[int, int] = field(default=(0, 0))
+    body: bytes | None = field(default=None)
+
+    @classmethod
+    def for_file(
+        cls,
+        file_path: Path,
+        stat: os.stat_result,
+        original_file_path: Path | None = None,
+        encoding: str | None = None,
+    ) -> FileResponse:
+        """
+        Describes a response for 'file_path'. Precompressed variants pass the
+        file they were compressed from as 'original_file_path' and their
+        'encoding'.
+        """
+        original_file_path = original_file_path or file_path
+        etag_suffix = f"-{encoding}" if encoding else ""
+        headers = {
+            "Content-Type": content_type_for(original_file_path),
+            "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{etag_suffix}"',
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Accept-Ranges": "bytes",
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if is_compressible(original_file_path):
+            headers["Vary"] = "Accept-Encoding"
+        return cls(
+            file_path=file_path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            headers=headers,
+            file_stat=(stat.st_size, stat.st_mtime_ns),
+        )
+
+
+class FileCache:
+    """
+    Byte-bounded LRU cache of file responses, so hot files are served from
+    memory. Entries are evicted when the watcher rewrites their file, and
+    checked against the file's size and modification time on every hit, so
+    files rewritten by anything else are not served stale either.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[Path, FileResponse] = OrderedDict()
+
+    def get(self, file_path: Path) -> FileResponse | None:
+        response = self.entries.get(file_path)
+        if not response:
+            return None
         try:
-            method, uri = await receive_http_get_request(reader)
-            # TODO make more robust, parse URI with urllib.
-            uri = uri.removeprefix("/")
-            uri = uri or "index.html"
-            FILE_PATH = (config.dist / uri).resolve()
+            stat = file_path.stat()
+            file_stat = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            file_stat = None
+        if file_stat != response.file_stat:
+            self.evict(file_path)
+            return None
+        self.entries.move_to_end(file_path)
+        return response
+
+    def accepts(self, size: int) -> bool:
+        return size <= self.max_size
+
+    def put(self, response: FileResponse):
+        # Only this entry: the other encodings of the file are still valid.
+        self.evict(response.file_path)
+        self.entries[response.file_path] = response
+        self.size += response.size
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
 
+    def invalidate(self, file_paths: set[Path]):
+        for file_path in file_paths:
+            file_path = file_path.resolve()
+            variants = [variant_path(file_path, encoding) for encoding in ENCODERS]
+            for cached_file_path in [file_path, *variants]:
+                self.evict(cached_file_path)
+
+    def evict(self, file_path: Path):
+        if response := self.entries.pop(file_path, None):
+            logger.debug(f"Evicting '{file_path}' from the file cache")
+            self.size -= response.size
+
+
+async def send_file_response(
+    writer: StreamWriter,
+    request: Request,
+    response: FileResponse,
+    file: BinaryIO | None = None,
+):
+    """Sends 'response', either from its in-memory body or from 'file'."""
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    if is_not_modified(request, etag, response.mtime):
+        headers = {k: v for k, v in response.headers.items() if k != "Content-Type"}
+        write_http_head(writer, HTTPStatus.NOT_MODIFIED, headers)
+        await writer.drain()
+        return
+    status = HTTPStatus.OK
+    headers = dict(response.headers)
+    offset, count = 0, response.size
+    if byte_range := requested_range(request, response.size, etag, last_modified):
+        status = HTTPStatus.PARTIAL_CONTENT
+        offset, count = byte_range
+        headers["Content-Range"] = (
+            f"bytes {offset}-{offset + count - 1}/{response.size}"
+        )
+    write_http_head(writer, status, {**headers, "Content-Length": count})
+    if request.method == "HEAD" or not count:
+        await writer.drain()
+        return
+    if response.body is not None:
+        writer.write(response.body[offset : offset + count])
+        await writer.drain()
+        return
+    await writer.drain()
+    logger.debug(f"sending file {response.file_path}")
+    await get_running_loop().sendfile(writer.transport, file, offset, count)
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for token in request.headers.get("accept-encoding", "").split(","):
+        encoding, _, params = token.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def negotiate_encoding(request: Request, file_path: Path) -> tuple[Path, str | None]:
+    """
+    Picks the precompressed variant of 'file_path' the client accepts, as long
+    as it was compressed from the current version of the file.
+    """
+    if not is_compressible(file_path) or "range" in request.headers:
+        return file_path, None
+    accepted = accepted_encodings(request)
+    for encoding in ENCODERS:
+        if encoding not in accepted and "*" not in accepted:
+            continue
+        try:
+            variant = variant_path(file_path, encoding)
+            if variant.stat().st_mtime_ns == file_path.stat().st_mtime_ns:
+                return variant, encoding
+        except FileNotFoundError:
+            continue
+    return file_path, None
+
+
+async def send_file(
+    writer: StreamWriter,
+    request: Request,
+    file_path: Path,
+    cache: FileCache | None = None,
+    live_reload: LiveReload | None = None,
+):
+    inject = live_reload and content_type_for(file_path).startswith("text/html")
+    original_file_path = file_path
+    if not inject:
+        file_path, encoding = negotiate_encoding(request, file_path)
+    else:
+        encoding = None
+    if cache and (response := cache.get(file_path)):
+        return await send_file_response(writer, request, response)
+    with open(file_path, "rb") as file:
+        response = FileResponse.for_file(
+            file_path, os.fstat(file.fileno()), original_file_path, encoding
+        )
+        if inject:
+            response.body = live_reload.inject(file.read())
+            response.size = len(response.body)
+        if cache and cache.accepts(response.size):
+            response.body = response.body or file.read()
+            cache.put(response)
+        await send_file_response(writer, request, response, file)
+
+
+async def send_event_stream(writer: StreamWriter, live_reload: LiveReload):
+    """Streams live reload events to a browser until it disconnects."""
+    client = live_reload.subscribe()
+    try:
+        write_http_head(
+            writer,
+            HTTPStatus.OK,
+            {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"},
+        )
+        writer.write(b"retry: 1000\n\n")
+        await writer.drain()
+        while True:
+            try:
+                message = await wait_for(client.events.get(), KEEP_ALIVE_TIMEOUT)
+            except TimeoutError:
+                # Comments keep the stream open and notice closed connections.
+                message = ": ping\n\n"
+            writer.write(message.encode("utf-8"))
+            await writer.drain()
+    finally:
+        live_reload.unsubscribe(client)
+
+
+def configure_requestor(
+    config: Config,
+    cache: FileCache | None = None,
+    live_reload: LiveReload | None = None,
+):
+    async def respond(writer: StreamWriter, request: Request) -> bool:
+        """Responds to a single request, returning whether to keep the connection."""
+        try:
+            if live_reload and urlsplit(request.uri).path == EVENTS_PATH:
+                await send_event_stream(writer, live_reload)
+                return False
+            if live_reload and urlsplit(request.uri).path == WORKER_PATH:
+                await send_http_response(
+                    writer, WORKER_SCRIPT, content_type="text/javascript; charset=utf-8"
+                )
+                return request.keep_alive
+            FILE_PATH = resolve_file_path(config, request.uri)
             if FILE_PATH.name == "500.html":
                 raise Exception(
                     "Internal Server Test",
                     "This should always return an 500 internal server error.",
                 )
-            assert method == "GET", (
-                "This is a Static server! You can only make GET requests."
-            )
-            assert FILE_PATH.is_file(), f"No File '{FILE_PATH}' found."
-
-            response_body, mime_type = read_file(config, FILE_PATH)
-            await send_http_response(writer, response_body, content_type=mime_type)
-        except AssertionError as e:
+            if request.method not in ("GET", "HEAD"):
+                raise HTTPError(
+                    HTTPStatus.METHOD_NOT_ALLOWED,
+                    "This is a Static server! You can only make GET requests.",
+                    headers={"Allow": "GET, HEAD"},
+                )
+            if not FILE_PATH.is_file():
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"No File '{FILE_PATH}' found.")
+            await send_file(writer, request, FILE_PATH, cache, live_reload)
+            return request.keep_alive
+        except HTTPError as e:
             response_body = ",".join(e.args)
-            await send_http_response(writer, response_body.encode("utf-8"), status=400)
+            await send_http_response(
+                writer, response_body.encode("utf-8"), e.status, headers=e.headers
+            )
+            return request.keep_alive
+        except (ConnectionError, IncompleteReadError):
+            return False
         except Exception as e:
             response_body = "\n".join(
                 ["EXCEPTION:", *e.args, "-" * 40, traceback.format_exc()]
             )
             logger.info(response_body)
-            await send_http_response(writer, response_body.encode("utf-8"), status=500)
+            await send_http_response(
+                writer,
+                response_body.encode("utf-8"),
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+                headers={"Connection": "close"},
+            )
+            return False
+
+    async def handle_request(reader: StreamReader, writer: StreamWriter):
+        """
+        Serves requests on a connection until the client closes it, asks to
+        close it or stays idle for too long. Pipelined requests are answered
+        in order.
+        """
+        try:
+            while True:
+                try:
+                    request = await wait_for(
+                        receive_http_request(reader), KEEP_ALIVE_TIMEOUT
+                    )
+                except HTTPError as e:
+                    await send_http_response(
+                        writer, ",".join(e.args).encode("utf-8"), e.status
+                    )
+                    break
+                if not request or not await respond(writer, request):
+                    break
+        except (TimeoutError, ConnectionError, IncompleteReadError):
+            pass
         finally:
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
 
     return handle_request
 
 
-async def serve(port: int, config: Config | None):
+async def serve(
+    port: int, config: Config | None, cache_mb: int = 0, live_reload: bool = False
+):
     try:
         if not config:
             return
-        handle_request = configure_requestor(config)
+        cache = FileCache(cache_mb * 1024 * 1024) if cache_mb > 0 else None
+        if cache:
+            config.on_outputs_changed(cache.invalidate)
+        handle_request = configure_requestor(
+            config, cache, LiveReload(config) if live_reload else None
+        )
         server = await start_server(handle_request, "127.0.0.1", port)
         logger.info(f"~~~~~~~~~~~~~~~~~{'~' * len(str(port))}")
         logger.info(f"Serving on port {port} ~")
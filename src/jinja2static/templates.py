@@ -1,93 +1,309 @@
 from __future__ import annotations
 
+import json
 import logging
+import os
+import threading
 import traceback
+from collections.abc import Callable, Mapping
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
+from itertools import islice
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-from jinja2 import Environment, FileSystemLoader, meta
+from jinja2 import FileSystemLoader, meta
 from jinja2.exceptions import TemplateNotFound, TemplateSyntaxError, UndefinedError
+from jinja2.runtime import Context
+
+from .logger import configure_logging
+from .output import AtomicOutput
+from .profiler import active_profiler, enable_profiling, profiled_page, span
 
 if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
     from .config import Config
 
 logger = logging.getLogger(__name__)
 
+# Jinja2 yields many small strings while rendering. They are joined into
+# batches of this many before being written, as encoding, hashing and
+# writing each one on its own is several times slower than render().
+RENDER_BATCH_SIZE = 4096
+
+# Watcher rebuilds and page generators with fewer pages than this render
+# them in-process, since starting worker processes would take longer than
+# rendering the pages.
+PARALLEL_MIN_PAGES = 16
+
+_worker_config: Config | None = None
+
+_accessed_names: ContextVar[set[str] | None] = ContextVar(
+    "accessed_names", default=None
+)
+
+
+class TrackingContext(Context):
+    """
+    Template context recording the names the page being rendered looks up,
+    so data changes only rebuild the pages that read the changed keys.
+    """
+
+    def resolve_or_missing(self, key: str):
+        accessed = _accessed_names.get()
+        if accessed is not None:
+            accessed.add(key)
+        return super().resolve_or_missing(key)
+
 
 def build_page(config: Config, filepath: Path) -> bool:
-    return_status = True
-    template_filepath = filepath.relative_to(config.templates)
-    data = config.data_for(filepath)
+    accessed = set()
+    token = _accessed_names.set(accessed)
     try:
-        logger.debug(f"Building '{template_filepath}' with {data=}")
-        rendered_file = (
-            Environment(loader=FileSystemLoader(config.templates))
-            .get_template(str(template_filepath))
-            .render(config=config, **data)
+        built = render_page(config, filepath)
+    finally:
+        _accessed_names.reset(token)
+    # A failed render may not have looked up everything the page needs.
+    config.record_data_access(filepath, accessed if built else None)
+    return built
+
+
+def render_page(config: Config, filepath: Path) -> bool:
+    template_name = filepath.relative_to(config.templates).as_posix()
+    with profiled_page(template_name):
+        with span("data", template_name):
+            data = config.data_for(filepath)
+        return render_template(
+            config, template_name, config.output_path_for(filepath), data
         )
-    except UndefinedError as e:
-        rendered_file = f"Building '{filepath}': {e}"
-        logger.error(rendered_file)
-        return_status = False
-    except Exception as e:
-        rendered_file = "\n".join([str(e), "-" * 40, traceback.format_exc()])
-        logger.info(rendered_file)
-        logger.error(f"Unable to render '{filepath}'")
-        rendered_file = rendered_file.replace("\n", "<br/>")
-        return_status = False
-    DST_FILE_PATH = config.dist / template_filepath
-    DST_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(DST_FILE_PATH, "w") as f:
+
+
+def render_template(
+    config: Config, template_name: str, dst_file_path: Path, data: Mapping
+) -> bool:
+    """Renders 'template_name' with 'data' into 'dst_file_path'."""
+    with AtomicOutput(dst_file_path) as f:
+        try:
+            if logger.isEnabledFor(logging.DEBUG):
+                # Formatting the data of every page is expensive.
+                logger.debug(f"Building '{template_name}' with {data=}")
+            with span("load", template_name):
+                template = config.environment.get_template(template_name)
+            with span("render", template_name):
+                chunks = template.generate(data, config=config)
+                while batch := "".join(islice(chunks, RENDER_BATCH_SIZE)):
+                    f.write(batch)
+            return True
+        except UndefinedError as e:
+            rendered_file = f"Building '{dst_file_path}': {e}"
+            logger.error(rendered_file)
+        except Exception as e:
+            rendered_file = "\n".join([str(e), "-" * 40, traceback.format_exc()])
+            logger.info(rendered_file)
+            logger.error(f"Unable to render '{dst_file_path}'")
+            rendered_file = rendered_file.replace("\n", "<br/>")
+        # Replace whatever was streamed before the failure with the error.
+        f.reset()
         f.write(rendered_file)
-    return return_status
+        return False
+
+
+class TemplateLoader(FileSystemLoader):
+    """Loads templates from the project, timing their compilation when profiling."""
+
+    def load(self, environment, name, globals=None):
+        with span("compile", name):
+            return super().load(environment, name, globals)
+
+
+def _init_worker(config_kwargs: dict, log_level: int, profile: bool):
+    """
+    Gives each worker process its own Config, so the Jinja2 environment and
+    data modules stay warm across all of the pages that worker renders.
+    """
+    global _worker_config
+    from .config import Config
+
+    package_logger = logging.getLogger(__name__.split(".")[0])
+    if not package_logger.handlers:
+        configure_logging(log_level == logging.DEBUG)
+    if profile:
+        enable_profiling()
+    _worker_config = Config(**config_kwargs)
+
 
+def worker_config() -> Config | None:
+    """The Config of the current worker process, if it is one."""
+    return _worker_config
 
-def build_pages(config: Config) -> bool:
+
+def worker_pool(config: Config, jobs: int) -> ProcessPoolExecutor:
+    """Starts 'jobs' worker processes, each with its own copy of 'config'."""
+    config_kwargs = {f.name: getattr(config, f.name) for f in fields(config)}
+    log_level = logging.getLogger(__name__.split(".")[0]).level
+    # Deferred, since it pulls in multiprocessing.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    mp_context = None
+    if threading.active_count() > 1:
+        # Forking a process with other threads running (the watcher's event
+        # loop and rebuild thread) can deadlock the workers.
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+    return ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(config_kwargs, log_level, active_profiler() is not None),
+    )
+
+
+def worker_events() -> list[list]:
+    """The profiling events of the current worker process, to send back."""
+    profiler = active_profiler()
+    return profiler.drain() if profiler else []
+
+
+def collect_worker_events(events: list[list]):
+    profiler = active_profiler()
+    if profiler:
+        profiler.extend(events)
+
+
+def _build_page_in_worker(filepath: Path) -> tuple[bool, set[str] | None, list]:
+    built = build_page(_worker_config, filepath)
+    return built, _worker_config.data_access_for(filepath), worker_events()
+
+
+def build_pages(
+    config: Config,
+    jobs: int | None = None,
+    pages: list[Path] | None = None,
+    cancelled: Callable[[], bool] | None = None,
+) -> dict[Path, bool]:
+    """
+    Renders 'pages' (every page of the project by default) and returns
+    whether each one rendered successfully. Once 'cancelled' returns true,
+    pages that have not started rendering are skipped and left out of the
+    results.
+    """
+    cancelled = cancelled or (lambda: False)
+    pages = sorted(config.pages if pages is None else pages)
+    if not pages:
+        return {}
     logger.info(
-        f"Building pages {[str(page.relative_to(config.templates)) for page in config.pages]} from '{config.templates}'..."
+        f"Building pages {[str(page.relative_to(config.templates)) for page in pages]} from '{config.templates}'..."
     )
-    return all(build_page(config, page) for page in config.pages)
+    jobs = min(jobs or os.cpu_count() or 1, len(pages))
+    results = []
+    if jobs <= 1:
+        for page in pages:
+            if cancelled():
+                break
+            results.append(build_page(config, page))
+    else:
+        logger.debug(f"Rendering {len(pages)} pages across {jobs} processes")
+        with worker_pool(config, jobs) as executor:
+            chunksize = max(1, len(pages) // (jobs * 4))
+            for page, (result, accessed, events) in zip(
+                pages,
+                executor.map(_build_page_in_worker, pages, chunksize=chunksize),
+            ):
+                config.record_data_access(page, accessed)
+                collect_worker_events(events)
+                results.append(result)
+                if cancelled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+    failed = results.count(False)
+    if failed:
+        logger.error(f"{failed} of {len(pages)} pages failed to build.")
+    if len(results) < len(pages):
+        logger.info(f"Cancelled before building {len(pages) - len(results)} pages.")
+    return dict(zip(pages, results))
+
+
+def find_referenced_templates(config: Config, filepath: Path) -> set[Path]:
+    """
+    Finds the templates directly referenced by the given template.
+    """
+    template_name = filepath.relative_to(config.templates).as_posix()
+    env = config.environment
+    try:
+        # Get the source and AST (Abstract Syntax Tree)
+        source, filename, uptodate = env.loader.get_source(env, template_name)
+        ast = env.parse(source)
+    except TemplateSyntaxError as e:
+        logger.error(f"Unable to process template: {e}")
+        return set()
+    except TemplateNotFound:
+        logger.warning(f"Referenced template '{template_name}' not found.")
+        return set()
+    return {
+        config.templates / ref
+        for ref in meta.find_referenced_templates(ast)
+        if ref is not None
+    }
 
 
-def find_all_subtemplates(config: Config, filepath: Path):
+@dataclass
+class ReferenceCache:
     """
-    Recursively finds all templates referenced by the given template.
+    Direct template references, keyed by template path and only trusted while
+    the template's modification time and size are unchanged.
     """
-    template_filepath = filepath.relative_to(config.templates)
-    template_name = str(template_filepath)
-    env = Environment(loader=FileSystemLoader(config.templates))
-    found_templates = set()
-    unprocessed_templates = {template_name}
-    while unprocessed_templates:
-        current_template_name = unprocessed_templates.pop()
-        if current_template_name in found_templates:
-            continue
-
-        # Add to the set of processed templates
-        found_templates.add(config.templates / current_template_name)
 
+    file_path: Path = field()
+    entries: dict[str, list] = field(default_factory=dict)
+    changed: bool = field(default=False)
+
+    @classmethod
+    def load(cls, file_path: Path) -> ReferenceCache:
+        try:
+            with open(file_path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return cls(file_path=file_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to read template reference cache: {e}")
+            return cls(file_path=file_path)
+        logger.debug(f"Loaded {len(entries)} template references from '{file_path}'")
+        return cls(file_path=file_path, entries=entries)
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.file_path, "w") as f:
+                json.dump(self.entries, f)
+        except OSError as e:
+            logger.warning(f"Unable to save template reference cache: {e}")
+            return
+        self.changed = False
+
+    def discard(self, filepath: Path):
+        if self.entries.pop(str(filepath), None) is not None:
+            self.changed = True
+
+    def references_for(self, config: Config, filepath: Path) -> set[Path]:
         try:
-            # Get the source and AST (Abstract Syntax Tree)
-            source, filename, uptodate = env.loader.get_source(
-                env, current_template_name
-            )
-            ast = env.parse(source)
-
-            # Find all templates referenced in the current AST
-            referenced = meta.find_referenced_templates(ast)
-
-            # Add new, unprocessed templates to the queue
-            for ref in referenced:
-                if ref is not None and ref not in found_templates:
-                    unprocessed_templates.add(ref)
-
-        except TemplateSyntaxError as e:
-            logger.error(f"Unable to process template: {e}")
-            continue
-        except TemplateNotFound:
-            logger.warning(f"Referenced template '{current_template_name}' not found.")
-            continue
-
-    # Remove the initial template from the result set if you only want subtemplates
-    found_templates.discard(template_name)
-    return found_templates
+            stat = filepath.stat()
+        except FileNotFoundError:
+            return find_referenced_templates(config, filepath)
+        key = str(filepath)
+        entry = self.entries.get(key)
+        if entry and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return {Path(ref) for ref in entry[2]}
+        references = find_referenced_templates(config, filepath)
+        self.entries[key] = [
+            stat.st_mtime_ns,
+            stat.st_size,
+            sorted(str(ref) for ref in references),
+        ]
+        self.changed = True
+        return references
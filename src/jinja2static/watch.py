@@ -1,83 +1,387 @@
 import logging
+import os
 import time
+import traceback
+from asyncio import create_task, get_running_loop
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 
-from watchfiles import Change, awatch
+from watchfiles import Change, DefaultFilter, awatch
 
 from .assets import copy_asset_file
+from .compress import compress_changed_outputs
 from .config import Config
-from .templates import build_page
+from .data import DATA_FILE_SUFFIXES
+from .generate import build_generated_pages
+from .templates import PARALLEL_MIN_PAGES, build_pages
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long a continuous stream of changes is collected for.
+MAX_DEBOUNCE_MS = 1600
 
-def template_file_update(config: Config, file_path: Path):
-    start_time = time.perf_counter()
+
+@dataclass
+class RebuildPlan:
+    """
+    Everything a batch of file changes requires rebuilding. Pages and assets
+    affected by several changes are only rebuilt once.
+    """
+
+    pages: set[Path] = field(default_factory=set)
+    assets: set[Path] = field(default_factory=set)
+    removed: set[Path] = field(default_factory=set)
+    generate: bool = field(default=False)
+
+    def __bool__(self):
+        return bool(self.pages or self.assets or self.removed or self.generate)
+
+    def merge(self, other: "RebuildPlan"):
+        self.pages |= other.pages
+        self.assets |= other.assets
+        self.removed |= other.removed
+        self.generate = self.generate or other.generate
+
+
+class ProjectFilter(DefaultFilter):
+    """
+    Ignores the outputs and caches the watcher writes itself, which would
+    otherwise supersede the rebuild writing them.
+    """
+
+    def __init__(self, config: Config):
+        super().__init__()
+        self.ignored_paths = (str(config.dist), str(config.cache))
+
+    def __call__(self, change: Change, path: str) -> bool:
+        return super().__call__(change, path) and not any(
+            path == ignored or path.startswith(ignored + os.sep)
+            for ignored in self.ignored_paths
+        )
+
+
+def generates_with(config: Config, file_path: Path) -> bool:
+    """Whether a page generator renders a template using 'file_path'."""
+    return any(
+        file_path in config.get_subtemplates(generator.template)
+        for generator in config.data_module.page_generators()
+    )
+
+
+def data_reaches_generators(
+    config: Config, file_path: Path, changed_keys: set[str] | None
+) -> bool:
+    """
+    Whether a change to the data file 'file_path' may change the generated
+    pages. Python modules may define generators, so they always do. Other
+    data files do when they provide data to a generator's template, unless
+    none of their keys changed. What a generator reads is not tracked, so
+    any changed key counts.
+    """
+    if file_path.suffix == ".py":
+        return True
+    if changed_keys is not None and not changed_keys:
+        return False
+    data_mod = config.data_module.get_data_mod_for(file_path)
+    if not data_mod:
+        return True
+    return any(
+        data_mod.effects_template_file(generator.template)
+        for generator in config.data_module.page_generators()
+    )
+
+
+def template_file_update(config: Config, file_path: Path, plan: RebuildPlan):
+    config.add_page(file_path)
+    config.invalidate_template(file_path)
     config.update_dependency_graph(file_path)
-    files_to_rebuild = config.get_dependencies(file_path)
+    plan.pages |= config.get_dependencies(file_path)
     if file_path in config.pages:
-        files_to_rebuild.add(file_path)
-    logger.info(
-        f"Rebuilding {[str(file.relative_to(config.templates)) for file in files_to_rebuild]}..."
-    )
-    for file_path in files_to_rebuild:
-        build_page(config, file_path)
-    end_time = time.perf_counter()
-    logger.info(f"Rebuilt in {(end_time - start_time):.4f} seconds")
+        plan.pages.add(file_path)
+    plan.generate = plan.generate or generates_with(config, file_path)
 
 
-def detect_changes_copy_asset(config: Config, file_path: Path):
-    copy_asset_file(config, file_path.relative_to(config.assets))
+def template_file_delete(config: Config, file_path: Path, plan: RebuildPlan):
+    """
+    Removes the outputs of deleted pages and rebuilds the pages that
+    referenced a deleted template.
+    """
+    plan.generate = plan.generate or generates_with(config, file_path)
+    removed = config.remove_template(file_path)
+    for template in removed:
+        plan.pages |= config.get_dependencies(template)
+        if config.is_page(template):
+            plan.removed.add(config.output_path_for(template))
+    plan.pages -= removed
 
 
-def data_file_update(config: Config, file_path: Path):
-    start_time = time.perf_counter()
-    config.data_module.update(file_path)
-    files_to_rebuild = config.data_module.effected_pages(file_path)
-    logger.info(
-        f"Rebuilding {[str(file.relative_to(config.templates)) for file in files_to_rebuild]}..."
+def detect_changes_copy_asset(config: Config, file_path: Path, plan: RebuildPlan):
+    plan.assets.add(file_path)
+
+
+def asset_file_delete(config: Config, file_path: Path, plan: RebuildPlan):
+    """
+    Removes the copies of deleted assets, or of every asset under a deleted
+    directory, leaving page and generated outputs alone.
+    """
+    dst_file_path = config.dist / file_path.relative_to(config.assets)
+    if not dst_file_path.is_dir():
+        plan.removed.add(dst_file_path)
+        return
+    page_outputs = {config.output_path_for(page) for page in config.pages}
+    page_outputs |= {config.dist / output for output in config.generated_outputs}
+    for dir_path, _, file_names in os.walk(dst_file_path):
+        for file_name in file_names:
+            output = Path(dir_path) / file_name
+            source = config.assets / output.relative_to(config.dist)
+            if output in page_outputs or output.with_suffix("") in page_outputs:
+                continue
+            if not source.exists():
+                plan.removed.add(output)
+
+
+def data_file_update(config: Config, file_path: Path, plan: RebuildPlan):
+    changed_keys = None
+    if config.data_module.get_data_mod_for(file_path):
+        changed_keys = config.data_module.update(file_path)
+    elif file_path.suffix in DATA_FILE_SUFFIXES:
+        # A data file the module tree does not know about yet.
+        config.update_data_module()
+    pages = config.data_module.effected_pages(file_path)
+    if changed_keys is not None:
+        logger.info(f"Changed data: {sorted(changed_keys)}")
+        pages = [page for page in pages if config.reads_data(page, changed_keys)]
+    plan.pages.update(pages)
+    plan.generate = plan.generate or data_reaches_generators(
+        config, file_path, changed_keys
     )
-    for file_path in files_to_rebuild:
-        build_page(config, file_path)
-    end_time = time.perf_counter()
-    logger.info(f"Rebuilt in {(end_time - start_time):.4f} seconds")
 
 
-def tbd(_: Config, _x: Path):
-    logger.warning("TBD")
-    return
+def data_file_delete(config: Config, file_path: Path, plan: RebuildPlan):
+    plan.pages.update(config.data_module.effected_pages(file_path))
+    config.update_data_module()
+    plan.generate = True
 
 
 def update_project_callback(config: Config, file_path: Path):
     if config.templates in file_path.parents:
-        return template_file_update, tbd
+        return template_file_update, template_file_delete
     if config.assets in file_path.parents:
-        return detect_changes_copy_asset, tbd
+        return detect_changes_copy_asset, asset_file_delete
     if file_path in config.data_module:
-        return data_file_update, tbd
+        return data_file_update, data_file_delete
     return None, None
 
 
-async def watch(config: Config):
+def remove_output(config: Config, file_path: Path):
+    """Removes an output along with the directories it leaves empty."""
+    if not file_path.is_file():
+        return
+    file_path.unlink()
+    logger.info(f"Removed '{file_path.relative_to(config.dist)}'")
+    for dir_path in file_path.parents:
+        if dir_path == config.dist or not dir_path.is_relative_to(config.dist):
+            return
+        try:
+            dir_path.rmdir()
+        except OSError:
+            return
+
+
+def output_stat(file_path: Path) -> tuple[int, int] | None:
+    try:
+        stat = file_path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def plan_rebuild(config: Config, changes: set[tuple[Change, str]]) -> RebuildPlan:
+    """
+    Updates the project's state for a batch of file changes and collects what
+    needs rebuilding. A file changed several times in the batch is handled
+    once, according to whether it still exists.
+    """
+    plan = RebuildPlan()
+    changed_files = {}
+    for change, file_path in changes:
+        changed_files.setdefault(Path(file_path), set()).add(change)
+    for file_path, file_changes in sorted(changed_files.items()):
+        update_fn, delete_fn = update_project_callback(config, file_path)
+        if not update_fn:
+            continue
+        file_path_str = file_path.relative_to(config.project_path)
+        if Change.deleted in file_changes and not file_path.exists():
+            logger.info(f"File '{file_path_str}' has been deleted...")
+            delete_fn(config, file_path, plan)
+        elif Change.added in file_changes:
+            logger.info(f"New file '{file_path_str}' has been created...")
+            update_fn(config, file_path, plan)
+        else:
+            logger.info(f"File '{file_path_str}' has changed...")
+            update_fn(config, file_path, plan)
+    config.reference_cache.save()
+    return plan
+
+
+def rebuild(
+    config: Config,
+    plan: RebuildPlan,
+    jobs: int | None = None,
+    cancelled: Callable[[], bool] | None = None,
+) -> tuple[set[Path], RebuildPlan]:
+    """
+    Carries out 'plan', stopping between pages once 'cancelled' returns true.
+    Returns the outputs it changed or removed, and what is left to rebuild.
+    Outputs rendered with the same content as before are left untouched, and
+    are not returned.
+    """
+    start_time = time.perf_counter()
+    previous_outputs = [
+        *plan.removed,
+        *(
+            config.dist / file_path.relative_to(config.assets)
+            for file_path in plan.assets
+        ),
+        *(config.output_path_for(page) for page in plan.pages),
+        *(config.dist / output for output in config.generated_outputs if plan.generate),
+    ]
+    previous_stats = {output: output_stat(output) for output in previous_outputs}
+    for file_path in sorted(plan.removed):
+        remove_output(config, file_path)
+    outputs = set(plan.removed)
+    for file_path in sorted(plan.assets):
+        copy_asset_file(config, file_path.relative_to(config.assets))
+        outputs.add(config.dist / file_path.relative_to(config.assets))
+    remaining = RebuildPlan()
+    if plan.pages:
+        if len(plan.pages) < PARALLEL_MIN_PAGES:
+            jobs = 1
+        results = build_pages(config, jobs, sorted(plan.pages), cancelled)
+        outputs |= {config.output_path_for(page) for page in results}
+        remaining.pages = plan.pages - results.keys()
+    if plan.generate:
+        outputs |= regenerate_pages(config, jobs, cancelled, remaining)
+    outputs = {
+        output
+        for output in outputs
+        if output_stat(output) != previous_stats.get(output)
+    }
+    if config.compress:
+        compress_changed_outputs(outputs)
+    end_time = time.perf_counter()
+    if remaining:
+        logger.info(
+            f"Rebuild superseded after {(end_time - start_time):.4f} seconds, deferring {len(remaining.pages)} pages"
+        )
+    else:
+        logger.info(f"Rebuilt in {(end_time - start_time):.4f} seconds")
+    return outputs, remaining
+
+
+def regenerate_pages(
+    config: Config,
+    jobs: int | None,
+    cancelled: Callable[[], bool] | None,
+    remaining: RebuildPlan,
+) -> set[Path]:
+    """
+    Reruns the page generators, removing the outputs they no longer
+    generate. Returns the outputs written or removed.
+    """
+    if len(config.generated_outputs) < PARALLEL_MIN_PAGES:
+        jobs = 1
+    results = build_generated_pages(config, jobs, cancelled)
+    outputs = {config.dist / output for output in results}
+    if cancelled and cancelled():
+        # Only some pages were generated, so nothing can be deemed removed.
+        config.generated_outputs |= results.keys()
+        remaining.generate = True
+        return outputs
+    for output in config.generated_outputs - results.keys():
+        remove_output(config, config.dist / output)
+        outputs.add(config.dist / output)
+    config.generated_outputs = set(results)
+    return outputs
+
+
+class Rebuilder:
+    """
+    Plans and carries out rebuilds on a single background thread, so the
+    event loop (and the development server on it) never waits for them.
+    A rebuild stops between pages as soon as newer changes come in, and the
+    pages it did not get to are added to the next rebuild.
+    """
+
+    def __init__(self, config: Config, jobs: int | None = None):
+        self.config = config
+        self.jobs = jobs
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="jinja2static-rebuild"
+        )
+        self.generation = 0
+        self.remaining = RebuildPlan()
+
+    def is_relevant(self, changes: set[tuple[Change, str]]) -> bool:
+        """Whether any of 'changes' is to a file the project is built from."""
+        return any(
+            update_project_callback(self.config, Path(file_path))[0]
+            for _, file_path in changes
+        )
+
+    def run(self, changes: set[tuple[Change, str]], generation: int) -> set[Path]:
+        plan = plan_rebuild(self.config, changes)
+        plan.merge(self.remaining)
+        # Kept until a rebuild completes, so one that fails is retried along
+        # with the next changes.
+        self.remaining = plan
+        if not plan:
+            return set()
+        outputs, self.remaining = rebuild(
+            self.config,
+            plan,
+            self.jobs,
+            cancelled=lambda: generation != self.generation,
+        )
+        return outputs
+
+    async def schedule(self, changes: set[tuple[Change, str]]):
+        if not self.is_relevant(changes):
+            return
+        # Supersedes the rebuild in progress, if any.
+        self.generation += 1
+        try:
+            outputs = await get_running_loop().run_in_executor(
+                self.executor, self.run, changes, self.generation
+            )
+        except Exception as e:
+            logger.error(f"Rebuild failed: {e}")
+            logger.info(traceback.format_exc())
+            return
+        if outputs:
+            self.config.publish_outputs_changed(outputs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def watch(config: Config, jobs: int | None = None):
     logger.info(f"Watching for file changes in '{config.project_path}'...")
-    async for changes in awatch(config.project_path):
-        for change, file_path in changes:
-            file_path = Path(file_path)
-            file_path_str = file_path.relative_to(config.project_path)
-            update_fn, delete_fn = update_project_callback(config, file_path)
-            if not update_fn:
-                continue
-            match change:
-                case Change.modified | Change.added:
-                    msg = (
-                        f"File '{file_path_str}' has changed..."
-                        if change == Change.modified
-                        else f"New file '{file_path_str}' has been created..."
-                    )
-                    logger.info(msg)
-                    update_fn(config, file_path)
-                case Change.deleted:
-                    logger.info(f"File '{file_path_str}' has been deleted...")
-                    delete_fn(config, file_path)
-                case _:
-                    logger.warning(f"File change '{change.name}' not registered.")
+    # Read up front, so the first rebuild does not wait for it.
+    config.ensure_dependency_graph()
+    rebuilder = Rebuilder(config, jobs)
+    rebuilds = set()
+    try:
+        async for changes in awatch(
+            config.project_path,
+            watch_filter=ProjectFilter(config),
+            step=config.debounce_ms,
+            debounce=max(config.debounce_ms, MAX_DEBOUNCE_MS),
+        ):
+            task = create_task(rebuilder.schedule(changes))
+            rebuilds.add(task)
+            task.add_done_callback(rebuilds.discard)
+    finally:
+        rebuilder.shutdown()
@@ -3,14 +3,49 @@ from pathlib import Path
 
 import pytest
 
-from jinja2static import configure_logging
+from jinja2static import Config, configure_logging
 
 RESUME_PATH = Path(__file__).parent / "mock_repos" / "resume"
 BLOG_PATH = Path(__file__).parent / "mock_repos" / "blog"
 
 
+def write_project(project_path, files):
+    for file_path, content in files.items():
+        file_path = project_path / file_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content)
+    return Config.from_(project_path)
+
+
 @pytest.fixture(scope="session")
 def logger():
     configure_logging(False)
     logger = logging.getLogger(__name__)
     return logger
+
+
+GENERATOR_MODULE = """
+from jinja2static.data import generate_pages
+
+POSTS = [{{"slug": f"post-{{i}}", "title": f"Post {{i}}"}} for i in range({posts})]
+
+
+@generate_pages(template="_post.html", url="posts/{{slug}}.html")
+def posts(data, config):
+    return iter(POSTS)
+
+
+@generate_pages(template="_list.html", url="blog/{{page}}.html", per_page=2)
+def listing(data, config):
+    return (post for post in POSTS)
+"""
+
+
+@pytest.fixture
+def generator_module():
+    """Source of a data module generating a page per post and paginated lists."""
+
+    def source(posts: int = 5) -> str:
+        return GENERATOR_MODULE.format(posts=posts)
+
+    return source
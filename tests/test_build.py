@@ -1,7 +1,23 @@
+import argparse
+import errno
+import gzip
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
 import pytest
-from conftest import BLOG_PATH, RESUME_PATH
+from conftest import BLOG_PATH, RESUME_PATH, write_project
+from jinja2 import DictLoader, Environment
 
+import jinja2static
 from jinja2static import Config, build
+from jinja2static.bytecode import CACHE_FILE_PATTERN, BoundedBytecodeCache
+from jinja2static.manifest import BuildManifest
 
 
 @pytest.mark.parametrize(
@@ -11,3 +27,463 @@ def test_build_resume(test_type, project_file_path, logger):
     logger.warning(f"BUILDING {test_type} TEST")
     config = Config.from_(project_file_path)
     assert build(config)
+
+
+def test_build_compiles_each_template_once(tmp_path, monkeypatch):
+    files = {
+        "templates/_base.html": "<h1>{% block body %}{% endblock %}</h1>",
+        "templates/index.html": "{% extends '_base.html' %}{% block body %}home{% endblock %}",
+        "templates/about.html": "{% extends '_base.html' %}{% block body %}about{% endblock %}",
+        "assets/style.css": "body {}",
+    }
+    config = write_project(tmp_path, files)
+    environment = config.environment
+    compile_template = environment.compile
+    compiled = []
+
+    def compile_and_record(source, name=None, *args, **kwargs):
+        compiled.append(name)
+        return compile_template(source, name, *args, **kwargs)
+
+    monkeypatch.setattr(environment, "compile", compile_and_record)
+    assert build(config, jobs=1)
+    assert sorted(compiled) == ["_base.html", "about.html", "index.html"]
+    assert config.environment is environment
+
+    # Only the invalidated template is compiled again.
+    base = config.templates / "_base.html"
+    base.write_text("<h2>{% block body %}{% endblock %}</h2>")
+    config.invalidate_template(base)
+    compiled.clear()
+    assert build(config, jobs=1)
+    assert compiled == ["_base.html"]
+    assert (config.dist / "index.html").read_text() == "<h2>home</h2>"
+
+
+WORKER_MODULE = """
+from jinja2static.data import per_page_data
+
+
+@per_page_data
+def page_name(data, config, file_path):
+    return {"name": file_path.stem}
+"""
+
+
+def test_build_pages_in_workers(tmp_path):
+    files = {
+        f"templates/page_{i}.html": f"{{{{ name }}}} {i} {{{{ title }}}}"
+        for i in range(8)
+    }
+    files["templates/broken.html"] = "{{ 1 / 0 }}"
+    files["data/__init__.py"] = WORKER_MODULE
+    files["data/__init__.yaml"] = "title: Site\n"
+    files["assets/style.css"] = "body {}"
+    config = write_project(tmp_path, files)
+    assert not build(config, jobs=2)
+    for i in range(8):
+        assert (config.dist / f"page_{i}.html").read_text() == f"page_{i} {i} Site"
+    assert "division by zero" in (config.dist / "broken.html").read_text()
+    # Workers report the data each page read back to the parent.
+    page = config.templates / "page_0.html"
+    assert {"name", "title"} <= config.data_access_for(page)
+    assert config.data_access_for(config.templates / "broken.html") is None
+
+
+INCREMENTAL_FILES = {
+    "templates/_header.html": "<h1>Header</h1>",
+    "templates/index.html": "{% include '_header.html' %}home",
+    "templates/about.html": "{% include '_header.html' %}about",
+    "templates/contact.html": "contact",
+    "assets/style.css": "body {}",
+}
+
+
+def dist_mtimes(config):
+    return {
+        file_path.relative_to(config.dist).as_posix(): file_path.stat().st_mtime_ns
+        for file_path in config.dist.rglob("*")
+        if file_path.is_file()
+    }
+
+
+@pytest.fixture
+def built_project(tmp_path):
+    config = write_project(tmp_path, INCREMENTAL_FILES)
+    assert build(config, jobs=1, incremental=True)
+    return tmp_path
+
+
+def test_incremental_build_skips_unchanged(built_project, caplog):
+    config = Config.from_(built_project)
+    mtimes = dist_mtimes(config)
+    with caplog.at_level("INFO"):
+        assert build(config, jobs=1, incremental=True)
+    assert "Skipping 3 unchanged pages." in caplog.text
+    assert "Building pages" not in caplog.text
+    assert dist_mtimes(config) == mtimes
+
+
+def test_incremental_build_rebuilds_dependents(built_project, caplog):
+    config = Config.from_(built_project)
+    mtimes = dist_mtimes(config)
+    (config.templates / "_header.html").write_text("<h1>Changed</h1>")
+    with caplog.at_level("INFO"):
+        assert build(config, jobs=1, incremental=True)
+    assert "Building pages ['about.html', 'index.html']" in caplog.text
+    assert "Skipping 1 unchanged pages." in caplog.text
+    assert (config.dist / "index.html").read_text() == "<h1>Changed</h1>home"
+    assert dist_mtimes(config)["contact.html"] == mtimes["contact.html"]
+
+
+def test_incremental_build_prunes_deleted_files(built_project):
+    (built_project / "templates" / "about.html").unlink()
+    (built_project / "assets" / "style.css").unlink()
+    config = Config.from_(built_project)
+    assert build(config, jobs=1, incremental=True)
+    assert set(dist_mtimes(config)) == {"index.html", "contact.html"}
+
+
+def test_incremental_build_after_settings_change(built_project, caplog):
+    (built_project / "pyproject.toml").write_text(
+        "[tools.jinja2static]\nbytecode_cache_mb = 8\n"
+    )
+    config = Config.from_(built_project)
+    assert BuildManifest.load(config) is None
+    with caplog.at_level("INFO"):
+        assert build(config, jobs=1, incremental=True)
+    assert "doing a full build" in caplog.text
+    assert "Building pages ['about.html', 'contact.html', 'index.html']" in caplog.text
+    assert BuildManifest.load(config) is not None
+
+
+def test_incremental_build_with_corrupt_manifest(built_project, caplog):
+    config = Config.from_(built_project)
+    BuildManifest.file_path_for(config).write_text("{not json")
+    (config.dist / "index.html").unlink()
+    with caplog.at_level("INFO"):
+        assert build(config, jobs=1, incremental=True)
+    assert "Unable to read build manifest" in caplog.text
+    assert "Building pages ['about.html', 'contact.html', 'index.html']" in caplog.text
+    assert (config.dist / "index.html").read_text() == "<h1>Header</h1>home"
+    assert BuildManifest.load(config) is not None
+
+
+def cache_path(cache, name):
+    return Path(cache.directory) / (CACHE_FILE_PATTERN % cache.get_cache_key(name))
+
+
+def test_bytecode_cache_evicts_least_recently_used(tmp_path):
+    templates = {f"page_{i}.html": "{{ title }}" * 100 for i in range(4)}
+    cache = BoundedBytecodeCache(tmp_path / "bytecode", max_size=1 << 20)
+
+    def compile_template(name):
+        # A fresh environment, so the template is loaded from the cache.
+        environment = Environment(loader=DictLoader(templates), bytecode_cache=cache)
+        environment.get_template(name)
+
+    def cached():
+        return {name for name in templates if cache_path(cache, name).is_file()}
+
+    compile_template("page_0.html")
+    cache.max_size = cache_path(cache, "page_0.html").stat().st_size * 3
+    compile_template("page_1.html")
+    compile_template("page_2.html")
+    # Loading from the cache marks the entry as recently used.
+    compile_template("page_0.html")
+    assert cached() == {"page_0.html", "page_1.html", "page_2.html"}
+    compile_template("page_3.html")
+    assert cached() == {"page_0.html", "page_3.html"}
+
+
+def test_dependency_graph_follows_template_edits(tmp_path):
+    files = {
+        "templates/_nav.html": "nav",
+        "templates/_base.html": "{% include '_nav.html' %}{% block body %}{% endblock %}",
+        "templates/index.html": "{% extends '_base.html' %}",
+        "templates/about.html": "{% include '_nav.html' %}",
+        "templates/contact.html": "contact",
+    }
+    config = write_project(tmp_path, files)
+    templates = config.templates
+    assert config.get_dependencies(templates / "_nav.html") == {
+        templates / "index.html",
+        templates / "about.html",
+    }
+    assert config.get_subtemplates(templates / "index.html") == {
+        templates / "index.html",
+        templates / "_base.html",
+        templates / "_nav.html",
+    }
+
+    (templates / "about.html").write_text("about")
+    config.update_dependency_graph(templates / "about.html")
+    (templates / "contact.html").write_text("{% include '_nav.html' %}")
+    config.update_dependency_graph(templates / "contact.html")
+    assert config.get_dependencies(templates / "_nav.html") == {
+        templates / "index.html",
+        templates / "contact.html",
+    }
+
+
+def test_page_inventory_follows_template_files(tmp_path):
+    files = {
+        "templates/_base.html": "base",
+        "templates/index.html": "home",
+        "templates/blog/post.html": "post",
+    }
+    config = write_project(tmp_path, files)
+    templates = config.templates
+    assert config.pages == {templates / "index.html", templates / "blog" / "post.html"}
+
+    about = templates / "about.html"
+    about.write_text("about")
+    (templates / "_nav.html").write_text("nav")
+    config.add_page(about)
+    config.add_page(templates / "_nav.html")
+    assert about in config.pages
+    assert templates / "_nav.html" not in config.pages
+
+    about.unlink()
+    config.remove_page(about)
+    assert config.pages == {templates / "index.html", templates / "blog" / "post.html"}
+
+
+def test_reference_cache_is_reused_across_runs(tmp_path, monkeypatch):
+    config = write_project(tmp_path, INCREMENTAL_FILES)
+    assert build(config, jobs=1)
+    templates_module = importlib.import_module("jinja2static.templates")
+    find_referenced_templates = templates_module.find_referenced_templates
+    parsed = []
+
+    def find_and_record(config, file_path):
+        parsed.append(file_path.name)
+        return find_referenced_templates(config, file_path)
+
+    monkeypatch.setattr(templates_module, "find_referenced_templates", find_and_record)
+    config = Config.from_(tmp_path)
+    header = config.templates / "_header.html"
+    assert len(config.get_dependencies(header)) == 2
+    assert parsed == []
+
+    (config.templates / "about.html").write_text("about")
+    config = Config.from_(tmp_path)
+    assert config.get_dependencies(header) == {config.templates / "index.html"}
+    assert parsed == ["about.html"]
+
+
+def test_pages_stream_to_disk(tmp_path):
+    files = {
+        "templates/large.html": "{% for i in range(20000) %}{{ i }}\n{% endfor %}",
+        "templates/broken.html": "{% for i in range(1000) %}{{ i }}{% endfor %}{{ 1 / 0 }}",
+        "assets/style.css": "body {}",
+    }
+    config = write_project(tmp_path, files)
+    assert not build(config, jobs=1)
+    expected = "".join(f"{i}\n" for i in range(20000))
+    assert (config.dist / "large.html").read_text() == expected
+    # Whatever was streamed before the error is replaced by the error.
+    broken = (config.dist / "broken.html").read_text()
+    assert "division by zero" in broken
+    assert not broken.startswith("0123")
+    assert list(config.dist.glob(".*.tmp")) == []
+
+
+def test_full_build_only_rewrites_changed_outputs(tmp_path):
+    files = {
+        "templates/index.html": "home",
+        "templates/about.html": "about",
+        "assets/style.css": "body {}",
+        "dist/orphan/old.html": "old",
+    }
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=1)
+    assert set(dist_mtimes(config)) == {"index.html", "about.html", "style.css"}
+    assert not (config.dist / "orphan").exists()
+
+    # Backdated, so a rewrite would be noticed however coarse the clock is.
+    index = config.dist / "index.html"
+    os.utime(index, ns=(0, 0))
+    (config.templates / "about.html").write_text("changed")
+    config = Config.from_(tmp_path)
+    assert build(config, jobs=1)
+    assert index.stat().st_mtime_ns == 0
+    assert (config.dist / "about.html").read_text() == "changed"
+
+
+def unsupported(*args):
+    raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+
+@pytest.mark.parametrize("copy_file_range", [True, False])
+def test_clone_file_falls_back(tmp_path, monkeypatch, copy_file_range):
+    assets_module = importlib.import_module("jinja2static.assets")
+    monkeypatch.setattr(assets_module, "fcntl", SimpleNamespace(ioctl=unsupported))
+    if not copy_file_range:
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    copyfileobj = shutil.copyfileobj
+    copied_in_userspace = []
+
+    def record_copyfileobj(*args):
+        copied_in_userspace.append(True)
+        return copyfileobj(*args)
+
+    monkeypatch.setattr(shutil, "copyfileobj", record_copyfileobj)
+    src_file_path = tmp_path / "src.bin"
+    src_file_path.write_bytes(os.urandom(1 << 20))
+    dst_file_path = tmp_path / "dst.bin"
+    dst_file_path.write_bytes(b"previous content")
+    assets_module.clone_file(src_file_path, dst_file_path)
+    assert dst_file_path.read_bytes() == src_file_path.read_bytes()
+    expect_userspace = not (copy_file_range and hasattr(os, "copy_file_range"))
+    assert bool(copied_in_userspace) == expect_userspace
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_generated_pages(tmp_path, jobs, generator_module):
+    files = {
+        "templates/index.html": "home",
+        "templates/_post.html": "{{ item.title }}",
+        "templates/_list.html": (
+            "{% for post in items %}{{ post.slug }} {% endfor %}"
+            "{{ pagination.number }} {{ pagination.next_url }}"
+        ),
+        "data/__init__.py": generator_module(),
+        "dist/posts/stale.html": "stale",
+    }
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=jobs)
+    dist = config.dist
+    assert (dist / "posts" / "post-3.html").read_text() == "Post 3"
+    assert (dist / "blog" / "1.html").read_text() == "post-0 post-1 1 /blog/2.html"
+    assert (dist / "blog" / "3.html").read_text() == "post-4 3 None"
+    assert not (dist / "blog" / "4.html").exists()
+    assert not (dist / "posts" / "stale.html").exists()
+    assert len(config.generated_outputs) == 8
+
+
+def test_build_generated_pages_in_workers(tmp_path, generator_module):
+    files = {
+        "templates/_post.html": "{{ item.title }}",
+        "templates/_list.html": "{{ pagination.number }}",
+        "data/__init__.py": generator_module(posts=100),
+    }
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=2)
+    assert (config.dist / "posts" / "post-99.html").read_text() == "Post 99"
+    assert (config.dist / "blog" / "50.html").read_text() == "50"
+    assert len(config.generated_outputs) == 150
+
+
+def test_generated_urls_reject_ambiguous_fields(tmp_path, caplog):
+    module = """
+from jinja2static.data import generate_pages
+
+
+@generate_pages(template="_post.html", url="posts/{index}.html")
+def posts(data, config):
+    return [{"index": "home"}]
+"""
+    files = {"templates/_post.html": "", "data/__init__.py": module}
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=1)
+    assert config.generated_outputs == set()
+    assert "uses ['index'], which items also have as fields" in caplog.text
+
+
+INDEX = "<html><body>" + "hello " * 100 + "</body></html>"
+
+
+def test_incremental_build_restores_missing_variants(tmp_path):
+    files = {
+        "pyproject.toml": "[tools.jinja2static]\ncompress = true\n",
+        "templates/index.html": INDEX,
+    }
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=1, incremental=True)
+    variant = config.dist / "index.html.gz"
+    variant.unlink()
+    assert build(Config.from_(tmp_path), jobs=1, incremental=True)
+    assert gzip.decompress(variant.read_bytes()).decode() == INDEX
+
+
+PROFILED_MODULE = """
+from jinja2static.data import per_page_data
+
+
+@per_page_data
+def slow_page_data(data, config, file_path):
+    return {"name": file_path.stem}
+"""
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_profile(tmp_path, jobs, caplog):
+    files = {
+        "templates/_base.html": "<h1>{% block body %}{% endblock %}</h1>",
+        "templates/index.html": "{% extends '_base.html' %}{% block body %}{{ name }}{% endblock %}",
+        "templates/about.html": "{% extends '_base.html' %}{% block body %}{{ name }}{% endblock %}",
+        "data/__init__.py": PROFILED_MODULE,
+        "assets/style.css": "body {}",
+    }
+    config = write_project(tmp_path, files)
+    trace_file_path = tmp_path / "trace.json"
+    with caplog.at_level("INFO"):
+        assert build(config, jobs=jobs, profile=trace_file_path)
+    report = caplog.text
+    assert "Slowest pages (2 built)" in report
+    assert "_base.html" in report
+    assert "slow_page_data" in report
+    trace = json.loads(trace_file_path.read_text())
+    pages = {
+        event["args"]["page"]
+        for event in trace["traceEvents"]
+        if event["cat"] == "render"
+    }
+    assert pages == {"index.html", "about.html"}
+    categories = {event["cat"] for event in trace["traceEvents"]}
+    assert {"data", "load", "compile", "write", "assets"} <= categories
+
+
+@pytest.mark.parametrize(
+    "setting",
+    [
+        'asset_copy_mode = "symlink"',
+        'bytecode_cache_mb = "64"',
+        "bytecode_cache_mb = -1",
+        'compress = "yes"',
+        "debounce_ms = true",
+        "dist = 1",
+    ],
+)
+def test_invalid_settings_are_rejected(tmp_path, caplog, setting):
+    key = setting.split(" ")[0]
+    files = {"pyproject.toml": f"[tools.jinja2static]\n{setting}\n"}
+    assert write_project(tmp_path, files) is None
+    assert f"'{key}' must" in caplog.text
+
+
+def test_profile_trace_must_be_a_file(tmp_path):
+    with pytest.raises(argparse.ArgumentTypeError):
+        jinja2static.trace_file_path(str(tmp_path))
+    trace_file_path = tmp_path / "trace.json"
+    assert jinja2static.trace_file_path(str(trace_file_path)) == trace_file_path
+
+
+def test_serving_does_not_import_build_dependencies():
+    # A fresh interpreter, since the tests have imported everything already.
+    code = (
+        "import sys\n"
+        "from jinja2static import Config\n"
+        "import jinja2static.serve\n"
+        f"config = Config.from_({str(BLOG_PATH)!r})\n"
+        "print(sorted({'jinja2', 'yaml', 'watchfiles'} & sys.modules.keys()))\n"
+    )
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(Path(jinja2static.__file__).parent.parent),
+    }
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=env
+    )
+    assert process.stdout.strip() == "[]", process.stderr
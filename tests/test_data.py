@@ -0,0 +1,121 @@
+import os
+import subprocess
+from datetime import datetime
+
+from conftest import write_project
+
+from jinja2static.data.helpers import (
+    get_creation_datetime,
+    get_git_logs,
+    get_last_updated_datetime,
+)
+
+
+def test_data_for_layers_modules(tmp_path):
+    config = write_project(
+        tmp_path,
+        {
+            "templates/index.html": "",
+            "templates/about.html": "",
+            "data/__init__.py": "",
+            "data/__init__.yaml": "title: Site\nsection: root\n",
+            "data/index.py": (
+                "from jinja2static.data import global_data\n"
+                "@global_data\n"
+                "def index(data, config):\n"
+                "    return {'section': 'index'}\n"
+            ),
+        },
+    )
+    index_data = config.data_for(config.templates / "index.html")
+    about_data = config.data_for(config.templates / "about.html")
+    assert index_data["title"] == "Site"
+    assert index_data["section"] == "index"
+    assert about_data["section"] == "root"
+    data_module = config.data_module.submodules[0]
+    assert config.data_module.modules_for(config.templates / "index.html") == (
+        config.data_module,
+        data_module,
+    )
+
+
+def test_empty_yaml_is_loaded_once(tmp_path):
+    config = write_project(
+        tmp_path, {"templates/index.html": "", "data.yaml": "# nothing yet\n"}
+    )
+    assert dict(config.data_for(config.templates / "index.html")) == {}
+    config.data_module.data_file_path.unlink()
+    # Already loaded, so the missing file is not read again.
+    assert config.data_module.file_data == {}
+
+
+def test_data_file_formats_and_snapshots(tmp_path):
+    config = write_project(
+        tmp_path,
+        {
+            "templates/index.html": "",
+            "templates/about.html": "",
+            "data/__init__.py": "",
+            "data/__init__.toml": 'title = "Site"\n',
+            "data/index.py": "",
+            "data/index.json": '{"section": "index"}',
+        },
+    )
+    assert config.data_for(config.templates / "index.html")["section"] == "index"
+    assert config.data_for(config.templates / "about.html")["title"] == "Site"
+    snapshots = list((config.cache / "data").glob("*.pickle"))
+    assert len(snapshots) == 1
+
+    (config.data / "__init__.toml").write_text('title = "Renamed"\n')
+    config.data_module.update(config.data / "__init__.toml")
+    assert config.data_for(config.templates / "about.html")["title"] == "Renamed"
+    # The previous snapshot of the file is replaced.
+    assert list((config.cache / "data").glob("*.pickle")) != snapshots
+    assert len(list((config.cache / "data").glob("*.pickle"))) == 1
+
+
+def commit(repo_path, date, *cmd):
+    env = {
+        **os.environ,
+        "GIT_AUTHOR_NAME": "test",
+        "GIT_AUTHOR_EMAIL": "test@example.com",
+        "GIT_COMMITTER_NAME": "test",
+        "GIT_COMMITTER_EMAIL": "test@example.com",
+        "GIT_COMMITTER_DATE": date,
+        "GIT_AUTHOR_DATE": date,
+    }
+    if cmd:
+        subprocess.run(["git", *cmd], cwd=repo_path, env=env, check=True)
+    subprocess.run(["git", "add", "-A"], cwd=repo_path, env=env, check=True)
+    subprocess.run(
+        ["git", "commit", "-q", "-m", date], cwd=repo_path, env=env, check=True
+    )
+
+
+def test_git_dates_follow_renames(tmp_path):
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    (tmp_path / "post.md").write_text("first\n" * 10)
+    (tmp_path / "other.md").write_text("other\n")
+    commit(tmp_path, "2024-01-01T00:00:00+00:00")
+    (tmp_path / "post.md").write_text("first\n" * 10 + "second\n")
+    commit(tmp_path, "2024-02-01T00:00:00+00:00")
+    commit(tmp_path, "2024-03-01T00:00:00+00:00", "mv", "post.md", "renamed.md")
+    (tmp_path / "other.md").write_text("changed\n")
+    commit(tmp_path, "2024-04-01T00:00:00+00:00")
+
+    post = tmp_path / "renamed.md"
+    assert get_creation_datetime(post) == datetime.fromisoformat(
+        "2024-01-01T00:00:00+00:00"
+    )
+    assert get_last_updated_datetime(post) == datetime.fromisoformat(
+        "2024-03-01T00:00:00+00:00"
+    )
+    assert get_creation_datetime(post) == get_git_logs(post, "--diff-filter=A")
+    assert get_last_updated_datetime(post) == get_git_logs(post, "-1")
+    # New commits move HEAD, which invalidates the cached history.
+    (tmp_path / "renamed.md").write_text("third\n")
+    commit(tmp_path, "2024-05-01T00:00:00+00:00")
+    assert get_last_updated_datetime(post) == datetime.fromisoformat(
+        "2024-05-01T00:00:00+00:00"
+    )
+    assert get_creation_datetime(tmp_path / "missing.md") is None
@@ -0,0 +1,259 @@
+import gzip
+import json
+import socket
+from asyncio import create_task, open_connection, sleep, wait_for
+
+import pytest
+from conftest import write_project
+
+from jinja2static import build, serve
+from jinja2static.livereload import (
+    CLIENT_SCRIPT,
+    EVENTS_PATH,
+    WORKER_PATH,
+    WORKER_SCRIPT,
+)
+from jinja2static.serve import FileCache, FileResponse
+
+INDEX = "<html><body>" + "hello " * 100 + "</body></html>"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_server(config, *args, **kwargs) -> int:
+    port = free_port()
+    task = create_task(serve(port, config, *args, **kwargs))
+    for _ in range(50):
+        try:
+            _, writer = await open_connection("127.0.0.1", port)
+            writer.close()
+            return port
+        except OSError:
+            await sleep(0.02)
+    task.cancel()
+    raise AssertionError("The server did not start")
+
+
+async def read_response(reader, method="GET"):
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    status_line, *header_lines = head.strip().split("\r\n")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = b""
+    if method != "HEAD" and int(status_line.split()[1]) != 304:
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return int(status_line.split()[1]), headers, body
+
+
+async def request(port, path="/index.html", method="GET", **headers):
+    reader, writer = await open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost"]
+    lines += [f"{name.replace('_', '-')}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    try:
+        return await read_response(reader, method)
+    finally:
+        writer.close()
+
+
+@pytest.fixture
+def site(tmp_path):
+    config = write_project(tmp_path, {"templates/index.html": INDEX})
+    assert build(config, jobs=1)
+    return config
+
+
+@pytest.mark.asyncio
+async def test_serve_keeps_connections_alive(site):
+    port = await start_server(site)
+    reader, writer = await open_connection("127.0.0.1", port)
+    for path in ["/index.html", "/", "/missing.html"]:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    responses = [await read_response(reader) for _ in range(3)]
+    assert [status for status, _, _ in responses] == [200, 200, 404]
+    assert responses[0][2] == INDEX.encode()
+    writer.write(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert (await read_response(reader))[0] == 200
+    assert await reader.read() == b""
+    writer.close()
+
+
+@pytest.mark.asyncio
+async def test_serve_conditional_requests(site):
+    port = await start_server(site)
+    status, headers, _ = await request(port)
+    assert status == 200
+    etag, last_modified = headers["etag"], headers["last-modified"]
+    status, headers, body = await request(port, if_none_match=etag)
+    assert status == 304
+    assert headers["etag"] == etag
+    assert "content-type" not in headers
+    status, _, _ = await request(port, if_modified_since=last_modified)
+    assert status == 304
+    status, _, _ = await request(port, if_none_match='"stale"')
+    assert status == 200
+
+
+@pytest.mark.asyncio
+async def test_serve_byte_ranges(site):
+    port = await start_server(site)
+    size = len(INDEX.encode())
+    status, headers, body = await request(port, range="bytes=0-9")
+    assert status == 206
+    assert body == INDEX.encode()[:10]
+    assert headers["content-range"] == f"bytes 0-9/{size}"
+    status, headers, body = await request(port, range="bytes=-5")
+    assert status == 206
+    assert body == INDEX.encode()[-5:]
+    status, headers, _ = await request(port, range=f"bytes={size}-")
+    assert status == 416
+    assert headers["content-range"] == f"bytes */{size}"
+    # A range of an older version of the file sends all of it.
+    status, _, body = await request(port, range="bytes=0-9", if_range='"stale"')
+    assert status == 200
+    assert body == INDEX.encode()
+
+
+@pytest.mark.asyncio
+async def test_serve_head_requests(site):
+    port = await start_server(site)
+    status, headers, body = await request(port, method="HEAD")
+    assert status == 200
+    assert int(headers["content-length"]) == len(INDEX.encode())
+    assert body == b""
+    status, headers, _ = await request(port, method="POST")
+    assert status == 405
+    assert headers["allow"] == "GET, HEAD"
+
+
+def cached_response(file_path):
+    response = FileResponse.for_file(file_path, file_path.stat())
+    response.body = file_path.read_bytes()
+    return response
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    a, b, c = (tmp_path / name for name in ["a.txt", "b.txt", "c.txt"])
+    for file_path in (a, b, c):
+        file_path.write_bytes(b"x" * 40)
+    cache = FileCache(100)
+    cache.put(cached_response(a))
+    cache.put(cached_response(b))
+    assert cache.get(a)
+    cache.put(cached_response(c))
+    assert cache.get(b) is None
+    assert cache.get(a) and cache.get(c)
+    assert cache.size == 80
+    assert not cache.accepts(101)
+
+
+@pytest.mark.asyncio
+async def test_serve_compressed_variants(tmp_path):
+    files = {
+        "pyproject.toml": "[tools.jinja2static]\ncompress = true\n",
+        "templates/index.html": INDEX,
+    }
+    config = write_project(tmp_path, files)
+    assert build(config, jobs=1)
+    assert (config.dist / "index.html.gz").is_file()
+    port = await start_server(config)
+    status, headers, body = await request(port, accept_encoding="gzip")
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == INDEX.encode()
+    status, headers, body = await request(port)
+    assert "content-encoding" not in headers
+    assert body == INDEX.encode()
+
+
+@pytest.mark.asyncio
+async def test_serve_injects_live_reload(site):
+    port = await start_server(site, live_reload=True)
+    status, headers, body = await request(port)
+    assert status == 200
+    assert body == INDEX.replace("</body>", CLIENT_SCRIPT.decode() + "</body>").encode()
+    assert int(headers["content-length"]) == len(body)
+    status, headers, body = await request(port, WORKER_PATH)
+    assert status == 200
+    assert headers["content-type"].startswith("text/javascript")
+    assert body == WORKER_SCRIPT
+    assert EVENTS_PATH.encode() in WORKER_SCRIPT
+    assert WORKER_PATH.encode() in CLIENT_SCRIPT
+
+
+@pytest.mark.asyncio
+async def test_serve_streams_live_reload_events(site):
+    port = await start_server(site, live_reload=True)
+    reader, writer = await open_connection("127.0.0.1", port)
+    writer.write(f"GET {EVENTS_PATH} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    assert b"Content-Type: text/event-stream" in head
+    assert await reader.readuntil(b"\n\n") == b"retry: 1000\n\n"
+
+    site.publish_outputs_changed({site.dist / "index.html", site.dist / "site.css"})
+    event = await wait_for(reader.readuntil(b"\n\n"), 1)
+    name, data = event.decode().strip().split("\n")
+    assert name == "event: change"
+    assert json.loads(data.removeprefix("data: ")) == {
+        "pages": ["/index.html"],
+        "stylesheets": ["/site.css"],
+        "reload": False,
+    }
+
+    site.publish_outputs_changed({site.dist / "logo.png"})
+    event = await wait_for(reader.readuntil(b"\n\n"), 1)
+    assert '"reload": true' in event.decode()
+    writer.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content_length", ["abc", "-1"])
+async def test_serve_rejects_invalid_content_length(site, content_length):
+    port = await start_server(site)
+    status, _, _ = await request(port, content_length=content_length)
+    assert status == 400
+
+
+def test_file_cache_checks_files_on_hit(tmp_path):
+    file_path = tmp_path / "a.txt"
+    file_path.write_bytes(b"old")
+    cache = FileCache(100)
+    cache.put(cached_response(file_path))
+    assert cache.get(file_path).body == b"old"
+    file_path.write_bytes(b"newer")
+    assert cache.get(file_path) is None
+    assert cache.size == 0
+    cache.put(cached_response(file_path))
+    file_path.unlink()
+    assert cache.get(file_path) is None
+
+
+def test_file_cache_keeps_compressed_variants(tmp_path):
+    file_path = tmp_path.resolve() / "index.html"
+    file_path.write_bytes(b"x" * 40)
+    variant = file_path.with_name("index.html.gz")
+    variant.write_bytes(b"x" * 20)
+    cache = FileCache(100)
+    cache.put(cached_response(variant))
+    cache.put(cached_response(file_path))
+    assert cache.get(file_path) and cache.get(variant)
+    # A rewritten file evicts all of its encodings.
+    cache.invalidate({file_path})
+    assert cache.get(file_path) is None
+    assert cache.get(variant) is None
+
+
+@pytest.mark.asyncio
+async def test_serve_cache_notices_rebuilt_files(site):
+    port = await start_server(site, 1)
+    assert (await request(port))[2] == INDEX.encode()
+    # Rebuilt by another process, so the server is not told about it.
+    (site.dist / "index.html").write_text("rebuilt")
+    assert (await request(port))[2] == b"rebuilt"
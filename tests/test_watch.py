@@ -1,14 +1,23 @@
+import importlib
 import os
+import shutil
 from asyncio import create_task, sleep, wait_for
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
 import pytest
-from conftest import BLOG_PATH, RESUME_PATH
+from conftest import BLOG_PATH, RESUME_PATH, write_project
 from watchfiles import Change, awatch
 
-from jinja2static import Config, watch
+from jinja2static import Config, build, watch
+from jinja2static.watch import (
+    ProjectFilter,
+    Rebuilder,
+    RebuildPlan,
+    plan_rebuild,
+    rebuild,
+)
 
 
 @dataclass
@@ -72,9 +81,13 @@ RESUME_CHANGES = [
     ),
     ChangeAssertion(touch_asset_file, "index.css", {Change.modified: ["index.css"]}),
     ChangeAssertion(touch_data_file, "data.yaml", {Change.modified: ["index.html"]}),
-    # ChangeAssertion(touch_template_file, "RANDO_FILE.html", { Change.added: [ "RANDO_FILE.html" ]}),
-    # ChangeAssertion(delete_template_file, "RANDO_FILE.html", { Change.deleted: [ ]}),
-    # ChangeAssertion(delete_template_file, "RANDO_FILE.html", { Change.deleted: [ "RANDO_FILE.html" ]}),
+    ChangeAssertion(
+        touch_template_file, "RANDO_FILE.html", {Change.added: ["RANDO_FILE.html"]}
+    ),
+    ChangeAssertion(delete_template_file, "RANDO_FILE.html", {Change.deleted: []}),
+    ChangeAssertion(
+        delete_template_file, "RANDO_FILE.html", {Change.deleted: ["RANDO_FILE.html"]}
+    ),
 ]
 BLOG_CHANGES = [
     ChangeAssertion(
@@ -93,6 +106,192 @@ BLOG_CHANGES = [
 ]
 
 
+def test_plan_rebuild_coalesces_changes():
+    config = Config.from_(BLOG_PATH)
+    changes = {
+        (Change.modified, str(config.templates / "_base.html")),
+        (Change.modified, str(config.templates / "index.html")),
+        (Change.added, str(config.templates / "index.html")),
+        (Change.modified, str(config.project_path / "data" / "index.py")),
+        (Change.modified, str(config.assets / "site.css")),
+        (Change.modified, str(config.dist / "index.html")),
+    }
+    plan = plan_rebuild(config, changes)
+    assert plan.pages == {
+        config.templates / "index.html",
+        config.templates / "about.html",
+    }
+    assert plan.assets == {config.assets / "site.css"}
+
+
+def test_plan_rebuild_handles_deletes(tmp_path):
+    project_path = tmp_path / "blog"
+    shutil.copytree(BLOG_PATH, project_path)
+    config = Config.from_(project_path)
+    deleted = [
+        config.templates / "_base.html",
+        config.templates / "about.html",
+        config.project_path / "data" / "index.py",
+    ]
+    for file_path in deleted:
+        file_path.unlink()
+    plan = plan_rebuild(config, {(Change.deleted, str(path)) for path in deleted})
+    assert plan.pages == {config.templates / "index.html"}
+    assert plan.removed == {config.dist / "about.html"}
+    assert config.templates / "about.html" not in config.pages
+
+
+def test_plan_rebuild_keeps_pages_under_deleted_asset_directories(
+    tmp_path, generator_module
+):
+    files = {
+        "pyproject.toml": "[tools.jinja2static]\ncompress = true\n",
+        "templates/_post.html": "{{ item.title }}",
+        "templates/_list.html": "{{ pagination.number }}",
+        "templates/blog/index.html": "blog",
+        "data/__init__.py": generator_module(),
+        "assets/blog/site.css": "body {}",
+    }
+    config = write_project(tmp_path, files)
+    build(config, jobs=1)
+    assert (config.dist / "blog" / "1.html").exists()
+    shutil.rmtree(config.assets / "blog")
+    plan = plan_rebuild(config, {(Change.deleted, str(config.assets / "blog"))})
+    assert plan.removed == {config.dist / "blog" / "site.css"}
+
+
+def test_data_changes_rebuild_pages_reading_them(tmp_path):
+    files = {
+        "templates/index.html": "{{ title }}",
+        "templates/about.html": "{{ footer }}",
+        "data.yaml": "title: Home\nfooter: Old\n",
+    }
+    config = write_project(tmp_path, files)
+    build(config, jobs=1)
+    data_file_path = tmp_path / "data.yaml"
+
+    data_file_path.write_text("title: Home\nfooter: New\n")
+    plan = plan_rebuild(config, {(Change.modified, str(data_file_path))})
+    assert plan.pages == {config.templates / "about.html"}
+
+    # Saving without changes rebuilds every page the file applies to.
+    plan = plan_rebuild(config, {(Change.modified, str(data_file_path))})
+    assert plan.pages == config.pages
+
+
+def test_data_changes_regenerate_pages(tmp_path, generator_module):
+    files = {
+        "templates/_post.html": "{{ item.title }}",
+        "templates/_list.html": "{{ items | length }}",
+        "data/__init__.py": generator_module(),
+    }
+    config = write_project(tmp_path, files)
+    build(config, jobs=1)
+    data_file_path = tmp_path / "data" / "__init__.py"
+    data_file_path.write_text(generator_module(posts=3))
+
+    plan = plan_rebuild(config, {(Change.modified, str(data_file_path))})
+    assert plan.generate
+    outputs, _ = rebuild(config, plan)
+    assert config.dist / "posts" / "post-4.html" in outputs
+    assert not (config.dist / "posts" / "post-4.html").exists()
+    assert not (config.dist / "blog" / "3.html").exists()
+    assert (config.dist / "blog" / "2.html").read_text() == "1"
+    assert config.generated_outputs == {
+        "posts/post-0.html",
+        "posts/post-1.html",
+        "posts/post-2.html",
+        "blog/1.html",
+        "blog/2.html",
+    }
+
+
+def test_data_changes_only_regenerate_pages_using_them(tmp_path, generator_module):
+    files = {
+        "templates/_post.html": "{{ item.title }}",
+        "templates/_list.html": "{{ title }}",
+        "templates/about.html": "{{ footer }}",
+        "data/__init__.py": generator_module(),
+        "data/__init__.yaml": "title: Home\n",
+        "data/about.py": "",
+        "data/about.yaml": "footer: Old\n",
+    }
+    config = write_project(tmp_path, files)
+    build(config, jobs=1)
+
+    # The generators' templates get no data from about.yaml.
+    (tmp_path / "data" / "about.yaml").write_text("footer: New\n")
+    changes = {(Change.modified, str(tmp_path / "data" / "about.yaml"))}
+    plan = plan_rebuild(config, changes)
+    assert plan.pages == {config.templates / "about.html"}
+    assert not plan.generate
+
+    (tmp_path / "data" / "__init__.yaml").write_text("title: Blog\n")
+    changes = {(Change.modified, str(tmp_path / "data" / "__init__.yaml"))}
+    assert plan_rebuild(config, changes).generate
+
+
+def test_project_filter_ignores_outputs_and_caches():
+    config = Config.from_(BLOG_PATH)
+    watch_filter = ProjectFilter(config)
+    assert watch_filter(Change.modified, str(config.templates / "index.html"))
+    assert not watch_filter(Change.added, str(config.dist / "index.html"))
+    assert not watch_filter(Change.added, str(config.dist / "index.html.tmp"))
+    assert not watch_filter(Change.modified, str(config.cache / "manifest.json"))
+
+
+@pytest.mark.asyncio
+async def test_failed_rebuild_is_retried(tmp_path, monkeypatch):
+    project_path = tmp_path / "blog"
+    shutil.copytree(BLOG_PATH, project_path)
+    config = Config.from_(project_path)
+    rebuilder = Rebuilder(config, jobs=1)
+    watch_module = importlib.import_module("jinja2static.watch")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Disk full")
+
+    monkeypatch.setattr(watch_module, "build_pages", fail)
+    (config.dist / "index.html").unlink(missing_ok=True)
+    await rebuilder.schedule({(Change.modified, str(config.templates / "_base.html"))})
+    assert rebuilder.remaining.pages == {
+        config.templates / "index.html",
+        config.templates / "about.html",
+    }
+    monkeypatch.undo()
+
+    # Changes to outputs do not supersede or start rebuilds.
+    await rebuilder.schedule({(Change.added, str(config.dist / "index.html"))})
+    assert rebuilder.generation == 1
+
+    await rebuilder.schedule({(Change.modified, str(config.templates / "_nav.html"))})
+    assert not rebuilder.remaining
+    assert (config.dist / "index.html").exists()
+    rebuilder.shutdown()
+
+
+def test_rebuild_returns_changed_outputs(tmp_path):
+    files = {"templates/index.html": "home", "templates/about.html": "about"}
+    config = write_project(tmp_path, files)
+    build(config, jobs=1)
+    plan = RebuildPlan(pages=set(config.pages))
+    outputs, _ = rebuild(config, plan)
+    assert outputs == set()
+
+    (config.templates / "index.html").write_text("changed")
+    plan_rebuild(config, {(Change.modified, str(config.templates / "index.html"))})
+    outputs, _ = rebuild(config, plan)
+    assert outputs == {config.dist / "index.html"}
+
+
+def test_cancelled_rebuild_defers_pages():
+    config = Config.from_(BLOG_PATH)
+    plan = RebuildPlan(pages=set(config.pages))
+    outputs, remaining = rebuild(config, plan, cancelled=lambda: True)
+    assert outputs == set()
+    assert remaining.pages == config.pages
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "test_type, project_file_path, project_changes",
@@ -112,9 +311,14 @@ async def test_run_dev_server_resume(
     for ca in project_changes:
         for change, file_paths in ca.dst_file_changes.items():
             for file_path in file_paths:
-                task = create_task(
-                    wait_for_file_change(config.dist / file_path, change)
-                )
+                dst_file_path = config.dist / file_path
+                expected_change = change
+                if change == Change.modified:
+                    # Unchanged outputs are not rewritten, so remove the output
+                    # and wait for the rebuild to recreate it.
+                    dst_file_path.unlink(missing_ok=True)
+                    expected_change = Change.added
+                task = create_task(wait_for_file_change(dst_file_path, expected_change))
                 await sleep(0.1)
                 ca.run(config)
                 try: